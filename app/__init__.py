@@ -1,12 +1,15 @@
 ﻿import os
+from datetime import timedelta
 
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 
+from .storage import RoutingSession
 
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 login_manager = LoginManager()
 jwt = JWTManager()
 
@@ -17,8 +20,46 @@ def create_app(config_object=None):
         SECRET_KEY=os.environ.get("SECRET_KEY", "dev-secret-key"),
         SQLALCHEMY_DATABASE_URI=os.environ.get("DATABASE_URL", "sqlite:///employees.db"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        DB_PROFILE=os.environ.get("DB_PROFILE", "default"),
+        DB_POOL_SIZE=int(os.environ.get("DB_POOL_SIZE", "10")),
+        DB_MAX_OVERFLOW=int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+        DB_POOL_TIMEOUT=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        DB_READ_SPLIT=(os.environ.get("DB_READ_SPLIT", "false").lower() in {"1", "true", "yes"}),
+        SQLITE_BUSY_TIMEOUT_MS=int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        SQLITE_SYNCHRONOUS=os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        SQLITE_CACHE_SIZE_KB=int(os.environ.get("SQLITE_CACHE_SIZE_KB", "20000")),
         JWT_SECRET_KEY=os.environ.get("JWT_SECRET_KEY", "dev-jwt-secret"),
+        JWT_ACCESS_TOKEN_EXPIRES=timedelta(minutes=int(os.environ.get("JWT_ACCESS_TOKEN_MINUTES", "15"))),
+        JWT_REFRESH_TOKEN_EXPIRES=timedelta(days=int(os.environ.get("JWT_REFRESH_TOKEN_DAYS", "30"))),
+        TOKEN_REVOCATION_SYNC_INTERVAL=float(os.environ.get("TOKEN_REVOCATION_SYNC_INTERVAL", "5")),
         SEED_DEFAULT_DATA=(os.environ.get("SEED_DEFAULT_DATA", "true").lower() in {"1", "true", "yes"}),
+        BULK_IMPORT_BATCH_SIZE=int(os.environ.get("BULK_IMPORT_BATCH_SIZE", "500")),
+        PRINCIPAL_CACHE_SIZE=int(os.environ.get("PRINCIPAL_CACHE_SIZE", "1024")),
+        PRINCIPAL_CACHE_TTL=float(os.environ.get("PRINCIPAL_CACHE_TTL", "60")),
+        DASHBOARD_STATS_TTL=float(os.environ.get("DASHBOARD_STATS_TTL", "300")),
+        PAYROLL_REPORT_TTL=float(os.environ.get("PAYROLL_REPORT_TTL", "300")),
+        LEAVE_WEEKMASK=os.environ.get("LEAVE_WEEKMASK", "1111100"),
+        LEAVE_HOLIDAYS=[value.strip() for value in os.environ.get("LEAVE_HOLIDAYS", "").split(",") if value.strip()],
+        LEAVE_INDEX_TTL=float(os.environ.get("LEAVE_INDEX_TTL", "300")),
+        LOGIN_THROTTLE_ENABLED=(os.environ.get("LOGIN_THROTTLE_ENABLED", "true").lower() in {"1", "true", "yes"}),
+        LOGIN_THROTTLE_BACKEND=os.environ.get("LOGIN_THROTTLE_BACKEND", "memory"),
+        LOGIN_RATE_LIMIT_IP=os.environ.get("LOGIN_RATE_LIMIT_IP", "30/60"),
+        LOGIN_RATE_LIMIT_USERNAME=os.environ.get("LOGIN_RATE_LIMIT_USERNAME", "5/60"),
+        METRICS_ENABLED=(os.environ.get("METRICS_ENABLED", "true").lower() in {"1", "true", "yes"}),
+        SERVER_TIMING_ENABLED=(os.environ.get("SERVER_TIMING_ENABLED", "true").lower() in {"1", "true", "yes"}),
+        METRICS_TOKEN=os.environ.get("METRICS_TOKEN"),
+        METRICS_DIR=os.environ.get("METRICS_DIR"),
+        EMPLOYEE_SEARCH_TTL=float(os.environ.get("EMPLOYEE_SEARCH_TTL", "300")),
+        AUDIT_BATCH_SIZE=int(os.environ.get("AUDIT_BATCH_SIZE", "200")),
+        AUDIT_FLUSH_INTERVAL=float(os.environ.get("AUDIT_FLUSH_INTERVAL", "2")),
+        JOB_WORKER_ENABLED=(os.environ.get("JOB_WORKER_ENABLED", "true").lower() in {"1", "true", "yes"}),
+        JOB_WORKER_THREADS=int(os.environ.get("JOB_WORKER_THREADS", "2")),
+        JOB_POLL_INTERVAL=float(os.environ.get("JOB_POLL_INTERVAL", "5")),
+        JOB_MAX_ATTEMPTS=int(os.environ.get("JOB_MAX_ATTEMPTS", "5")),
+        JOB_RETRY_BASE_DELAY=float(os.environ.get("JOB_RETRY_BASE_DELAY", "2")),
+        JOB_RETRY_MAX_DELAY=float(os.environ.get("JOB_RETRY_MAX_DELAY", "600")),
+        JOB_LEASE_SECONDS=float(os.environ.get("JOB_LEASE_SECONDS", "300")),
+        JWT_TRUST_ROLE_CLAIM=(os.environ.get("JWT_TRUST_ROLE_CLAIM", "false").lower() in {"1", "true", "yes"}),
     )
 
     if config_object:
@@ -27,17 +68,39 @@ def create_app(config_object=None):
         else:
             app.config.from_mapping(config_object)
 
+    from . import storage
+
+    storage.configure(app)
     db.init_app(app)
+    storage.init_app(app, db)
+
+    from . import metrics
+
+    metrics.init_app(app, db)
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
     login_manager.login_message_category = "warning"
     jwt.init_app(app)
 
-    from .models import User
+    from . import audit, benchmark, intervals, jobs, leave, principals, reports, search, server, stats, synthetic, throttle, tokens
+
+    audit.init_app(app)
+    benchmark.init_app(app)
+    intervals.init_app(app)
+    jobs.init_app(app)
+    leave.init_app(app)
+    principals.init_app(app)
+    reports.init_app(app)
+    search.init_app(app)
+    server.init_app(app)
+    stats.init_app(app)
+    synthetic.init_app(app)
+    throttle.init_app(app)
+    tokens.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return principals.load_user(int(user_id))
 
     from .auth import auth_bp, api_auth_bp
     from .routes import main_bp
@@ -49,7 +112,10 @@ def create_app(config_object=None):
     app.register_blueprint(api_bp, url_prefix="/api")
 
     with app.app_context():
-        db.create_all()
+        from .migrations import upgrade_schema
+
+        upgrade_schema()
+        tokens.load_revocations()
         if not app.config.get("TESTING") and app.config.get("SEED_DEFAULT_DATA", True):
             from .seed import seed_defaults
 
@@ -58,4 +124,15 @@ def create_app(config_object=None):
     return app
 
 
-app = create_app()
+_app = None
+
+
+def __getattr__(name):
+    # ``flask run`` and WSGI servers look up ``app.app``; build it on first access so that
+    # importing the package (tests, CLI tools) does not touch the database.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
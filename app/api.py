@@ -1,17 +1,54 @@
-﻿from datetime import datetime
-from typing import Optional
-
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import get_jwt_identity, jwt_required
-
-from . import db
-from .models import Employee, User
+﻿import csv
+import hashlib
+import io
+import json
+from datetime import date, datetime, timedelta, timezone
+from functools import wraps
+from typing import Iterator, Optional, Tuple
+
+from flask import Blueprint, Response, current_app, jsonify, make_response, request, stream_with_context
+from flask_jwt_extended import get_jwt, get_jwt_identity, jwt_required
+from sqlalchemy import insert, select
+from sqlalchemy.orm.exc import StaleDataError
+
+from . import audit, changes, db
+from .batch import BATCH_MODES, parse_sub_requests, run_batch
+from .intervals import clip_to_days, daily_counts, get_leave_index
+from .leave import (
+    DECISIONS,
+    LEAVE_STATUSES,
+    OVERLAP_MESSAGE,
+    compute_balances,
+    decide_leave_requests,
+    has_overlapping_leave,
+    parse_leave_period,
+    submit_leave_request,
+)
+from .models import AuditEvent, Employee, LeaveRequest, User
+from .pagination import keyset_page_desc
+from .reports import get_payroll_report
+from .search import get_search_index
+from .serializers import EMPLOYEE_PROJECTION, LEAVE_REQUEST_PROJECTION
+from .versions import get_table_version
+from .principals import Principal, get_principal
 
 
 api_bp = Blueprint("api", __name__)
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+IMPORT_MIMETYPES = {"text/csv", "application/x-ndjson", "application/ndjson"}
+MAX_IMPORT_ERRORS = 1000
+EXPORT_CHUNK_SIZE = 1000
+MAX_DECISION_BATCH = 1000
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_BATCH_REQUESTS = 50
+MAX_COVERAGE_DAYS = 366
+EXPORT_MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
 
-def _get_requesting_user() -> Optional[User]:
+def _get_requesting_user() -> Optional[Principal]:
     identity = get_jwt_identity()
     if identity is None:
         return None
@@ -19,25 +56,298 @@ def _get_requesting_user() -> Optional[User]:
         user_id = int(identity)
     except (TypeError, ValueError):
         return None
-    return User.query.get(user_id)
+    if current_app.config["JWT_TRUST_ROLE_CLAIM"] and request.method in {"GET", "HEAD"}:
+        # Read-only calls may rely on the role signed into the token at login.
+        claims = get_jwt()
+        if "role" in claims:
+            return Principal(id=user_id, username=claims.get("username"), role=claims["role"])
+    return get_principal(user_id)
 
 
-def _is_admin(user: Optional[User]) -> bool:
+def _is_admin(user: Optional[Principal]) -> bool:
     return bool(user and (user.role or "").lower() == "admin")
 
 
+def _parse_limit(value: Optional[str], default: int = DEFAULT_PAGE_SIZE, maximum: int = MAX_PAGE_SIZE) -> int:
+    if value is None or value == "":
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer.") from None
+    if limit < 1 or limit > maximum:
+        raise ValueError(f"limit must be between 1 and {maximum}.")
+    return limit
+
+
+def _parse_int_arg(name: str) -> Optional[int]:
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer.") from None
+
+
+def _parse_float_arg(name: str) -> Optional[float]:
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number.") from None
+
+
+def _parse_date_arg(name: str) -> Optional[date]:
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"{name} must be in YYYY-MM-DD format.") from None
+
+
+def _parse_datetime_arg(name: str) -> Optional[datetime]:
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime.") from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _http_last_modified(updated_at: Optional[datetime]) -> Optional[datetime]:
+    """``updated_at`` truncated to an HTTP date, or None while that second is still current.
+
+    HTTP dates have one-second resolution, so a date from the current second cannot tell the
+    client's copy apart from a later write in the same second. It is only a weak validator.
+    """
+    if updated_at is None:
+        return None
+    last_modified = updated_at.replace(microsecond=0)
+    if last_modified >= datetime.now(timezone.utc).replace(microsecond=0):
+        return None
+    return last_modified
+
+
+def _not_modified(etag: str, last_modified: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match, falling back to If-Modified-Since only when no ETag was sent."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+
+
+def conditional_get(model: type):
+    """Serve 304 Not Modified when ``model``'s table is unchanged since the client's copy.
+
+    The ETag combines the table's write counter with the caller and the full request path, so
+    an unchanged poll costs one primary-key lookup and skips the query and serialisation.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version, updated_at = get_table_version(model)
+            principal = _get_requesting_user()
+            scope = f"{request.full_path}|{principal.id if principal else ''}|{principal.role if principal else ''}"
+            etag = f"{model.__tablename__}-{version}-{hashlib.sha1(scope.encode('utf-8')).hexdigest()[:16]}"
+
+            last_modified = _http_last_modified(updated_at)
+            if _not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 @api_bp.get("/employees")
 @jwt_required(optional=True)
+@conditional_get(Employee)
 def list_employees():
     requesting_user = _get_requesting_user()
+    try:
+        fields = EMPLOYEE_PROJECTION.parse(request.args.get("fields"))
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+    # The id column is always selected because it drives the keyset cursor.
+    columns = EMPLOYEE_PROJECTION.columns(fields, required=[Employee.id])
+    query = db.session.query(*columns)
+
     if requesting_user and not _is_admin(requesting_user):
-        employee = Employee.query.filter_by(user_id=requesting_user.id).first()
-        if not employee:
-            return jsonify([])
-        return jsonify([employee.as_dict()])
+        rows = query.filter(Employee.user_id == requesting_user.id).limit(1).all()
+        items = list(EMPLOYEE_PROJECTION.serialize_all(rows, fields, columns))
+        return jsonify({"items": items, "next_cursor": None})
+
+    try:
+        limit = _parse_limit(request.args.get("limit"))
+        after = _parse_int_arg("after")
+        start_date_from = _parse_date_arg("start_date_from")
+        start_date_to = _parse_date_arg("start_date_to")
+        salary_min = _parse_float_arg("salary_min")
+        salary_max = _parse_float_arg("salary_max")
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    role = (request.args.get("role") or "").strip()
+    if role:
+        query = query.filter(Employee.role == role)
+    if start_date_from:
+        query = query.filter(Employee.start_date >= start_date_from)
+    if start_date_to:
+        query = query.filter(Employee.start_date <= start_date_to)
+    if salary_min is not None:
+        query = query.filter(Employee.salary >= salary_min)
+    if salary_max is not None:
+        query = query.filter(Employee.salary <= salary_max)
+    if after is not None:
+        query = query.filter(Employee.id > after)
+
+    # Fetch one extra row to learn whether another page exists without a COUNT(*).
+    rows = query.order_by(Employee.id.asc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1].id)
+    items = list(EMPLOYEE_PROJECTION.serialize_all(rows, fields, columns))
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+def _employee_etag(employee: Employee) -> str:
+    return f"employee-{employee.id}-{employee.version}"
+
+
+def _with_employee_etag(response: Response, employee: Employee) -> Response:
+    """Attach the row's strong ETag, which clients send back in If-Match to update it."""
+    response.set_etag(_employee_etag(employee))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _employee_conflict(message: str, status: int, employee: Optional[Employee]):
+    """Reject a stale write, returning the current row so the client can merge and retry."""
+    if employee is None:
+        return jsonify({"message": message}), status
+    return _with_employee_etag(jsonify({"message": message, "current": employee.as_dict()}), employee), status
+
+
+@api_bp.get("/employees/<int:employee_id>")
+@jwt_required()
+def get_employee(employee_id: int):
+    requesting_user = _get_requesting_user()
+    employee = db.session.get(Employee, employee_id)
+    if not employee or not (_is_admin(requesting_user) or (requesting_user and employee.user_id == requesting_user.id)):
+        return jsonify({"message": "Employee not found."}), 404
+    # The table's last write is never earlier than this row's, so it is a safe Last-Modified.
+    last_modified = _http_last_modified(get_table_version(Employee)[1])
+    if _not_modified(_employee_etag(employee), last_modified):
+        response = Response(status=304)
+    else:
+        response = jsonify(employee.as_dict())
+    if last_modified:
+        response.last_modified = last_modified
+    return _with_employee_etag(response, employee)
+
+
+@api_bp.get("/employees/search")
+@jwt_required()
+def search_employees():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return jsonify({"message": "q is required."}), 400
+    try:
+        limit = _parse_limit(request.args.get("limit"), default=DEFAULT_SEARCH_LIMIT, maximum=MAX_SEARCH_LIMIT)
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    results = get_search_index().search(query, limit)
+    return jsonify({"items": [result.as_dict() for result in results]})
+
+
+@api_bp.get("/employees/export")
+@jwt_required()
+def export_employees():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+    return _export_response(Employee, EMPLOYEE_PROJECTION, "employees")
+
+
+@api_bp.get("/leave-requests/export")
+@jwt_required()
+def export_leave_requests():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+    return _export_response(LeaveRequest, LEAVE_REQUEST_PROJECTION, "leave-requests")
+
 
-    employees = Employee.query.order_by(Employee.id.asc()).all()
-    return jsonify([employee.as_dict() for employee in employees])
+def _export_response(model, projection, filename: str):
+    export_format = (request.args.get("format") or "csv").strip().lower()
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({"message": "format must be 'csv' or 'ndjson'."}), 400
+    try:
+        fields = projection.parse(request.args.get("fields"))
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    columns = projection.columns(fields, required=[model.id])
+    statement = select(*columns).order_by(model.id.asc()).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    rows = projection.serialize_all(db.session.execute(statement), fields, columns)
+    if export_format == "csv":
+        chunks = _csv_chunks(rows, fields)
+    else:
+        chunks = _ndjson_chunks(rows)
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}.{export_format}"
+    return response
+
+
+def _csv_chunks(rows: Iterator[dict], fieldnames: list) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows: Iterator[dict]) -> Iterator[str]:
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
 
 
 @api_bp.post("/employees")
@@ -49,11 +359,6 @@ def create_employee():
 
     data = request.get_json() or {}
     user_id = data.get("user_id")
-    name = (data.get("name") or "").strip()
-    role = (data.get("role") or "").strip()
-    salary = data.get("salary")
-    start_date_str = (data.get("start_date") or "").strip()
-    leave_days_value = data.get("leave_days", 0)
 
     if not user_id or not isinstance(user_id, int):
         return jsonify({"message": "user_id is required and must be an integer."}), 400
@@ -64,50 +369,197 @@ def create_employee():
     if user.employee_profile:
         return jsonify({"message": "User already has an employee profile."}), 400
 
+    try:
+        fields = _parse_employee_fields(data)
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    employee = Employee(user=user, **fields)
+    db.session.add(employee)
+    db.session.commit()
+    return jsonify(employee.as_dict()), 201
+
+
+@api_bp.post("/employees/bulk")
+@jwt_required()
+def bulk_create_employees():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+
+    if request.mimetype not in IMPORT_MIMETYPES:
+        return jsonify({"message": "Send the body as text/csv or application/x-ndjson."}), 415
+
+    commit_mode = (request.args.get("commit") or "all").strip().lower()
+    if commit_mode not in {"all", "batch"}:
+        return jsonify({"message": "commit must be 'all' or 'batch'."}), 400
+
+    batch_size = current_app.config["BULK_IMPORT_BATCH_SIZE"]
+    report = {"created": 0, "failed": 0, "errors": []}
+    claimed_user_ids = set()
+    batch = []
+
+    try:
+        for row_number, data, error in _iter_import_rows(request.stream, request.mimetype):
+            if error is None:
+                try:
+                    user_id = _parse_import_user_id(data.get("user_id"))
+                    fields = _parse_employee_fields(data)
+                except ValueError as exc:
+                    error = str(exc)
+            if error is not None:
+                _record_import_error(report, row_number, error)
+                continue
+
+            batch.append((row_number, dict(fields, user_id=user_id)))
+            if len(batch) >= batch_size:
+                _insert_import_batch(batch, claimed_user_ids, report)
+                batch = []
+                if commit_mode == "batch":
+                    db.session.commit()
+    except UnicodeDecodeError:
+        # Batches already committed with ?commit=batch stay in place; ``created`` counts them.
+        db.session.rollback()
+        if commit_mode == "all":
+            report["created"] = 0
+        return jsonify({"message": "Body must be UTF-8 encoded.", **report}), 400
+
+    if batch:
+        _insert_import_batch(batch, claimed_user_ids, report)
+    db.session.commit()
+    return jsonify(report)
+
+
+def _parse_import_user_id(value) -> int:
+    # CSV cells arrive as text, so accept plain digit strings as well as JSON integers.
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise ValueError("user_id is required and must be an integer.")
+
+
+def _parse_employee_fields(data: dict) -> dict:
+    name = (data.get("name") or "").strip()
+    role = (data.get("role") or "").strip()
+    salary = data.get("salary")
+    start_date_str = (data.get("start_date") or "").strip()
+    leave_days_value = data.get("leave_days", 0)
+
     if not name or not role or salary is None or not start_date_str:
-        return jsonify({"message": "name, role, salary, and start_date are required."}), 400
+        raise ValueError("name, role, salary, and start_date are required.")
 
     try:
         salary_value = float(salary)
         if salary_value < 0:
             raise ValueError
     except (TypeError, ValueError):
-        return jsonify({"message": "salary must be a positive number."}), 400
+        raise ValueError("salary must be a positive number.") from None
 
     try:
         start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
     except ValueError:
-        return jsonify({"message": "start_date must be in YYYY-MM-DD format."}), 400
+        raise ValueError("start_date must be in YYYY-MM-DD format.") from None
 
     try:
         leave_days = int(leave_days_value)
         if leave_days < 0:
             raise ValueError
     except (TypeError, ValueError):
-        return jsonify({"message": "leave_days must be a non-negative integer."}), 400
-
-    employee = Employee(
-        user=user,
-        name=name,
-        role=role,
-        salary=salary_value,
-        start_date=start_date,
-        leave_days=leave_days,
-    )
-    db.session.add(employee)
-    db.session.commit()
-    return jsonify(employee.as_dict()), 201
+        raise ValueError("leave_days must be a non-negative integer.") from None
+
+    return {
+        "name": name,
+        "role": role,
+        "salary": salary_value,
+        "start_date": start_date,
+        "leave_days": leave_days,
+    }
+
+
+def _iter_import_rows(stream, mimetype: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Yield ``(row_number, data, error)`` for each record without buffering the body."""
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding="utf-8-sig", newline="")
+    if mimetype == "text/csv":
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            # Blank CSV cells mean "not provided" so optional columns fall back to their defaults.
+            yield row_number, {key: value for key, value in row.items() if key and value not in (None, "")}, None
+        return
+
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield row_number, None, "Row is not valid JSON."
+            continue
+        if not isinstance(data, dict):
+            yield row_number, None, "Row must be a JSON object."
+            continue
+        yield row_number, data, None
+
+
+def _insert_import_batch(batch: list, claimed_user_ids: set, report: dict) -> None:
+    user_ids = {fields["user_id"] for _, fields in batch}
+    existing_user_ids = set(db.session.scalars(select(User.id).where(User.id.in_(user_ids))))
+    profiled_user_ids = set(db.session.scalars(select(Employee.user_id).where(Employee.user_id.in_(user_ids))))
+
+    rows = []
+    for row_number, fields in batch:
+        user_id = fields["user_id"]
+        if user_id not in existing_user_ids:
+            _record_import_error(report, row_number, "Referenced user does not exist.")
+        elif user_id in profiled_user_ids or user_id in claimed_user_ids:
+            _record_import_error(report, row_number, "User already has an employee profile.")
+        else:
+            claimed_user_ids.add(user_id)
+            rows.append(fields)
+
+    if rows:
+        employee_ids = db.session.scalars(insert(Employee).returning(Employee.id, sort_by_parameter_order=True), rows).all()
+        changes.mark(Employee, employee_ids)
+        for employee_id, fields in zip(employee_ids, rows):
+            audit.record(Employee, employee_id, "create", {key: [None, value] for key, value in fields.items()})
+        report["created"] += len(rows)
+
 
+def _record_import_error(report: dict, row_number: int, message: str) -> None:
+    report["failed"] += 1
+    if len(report["errors"]) < MAX_IMPORT_ERRORS:
+        report["errors"].append({"row": row_number, "message": message})
+    else:
+        report["errors_truncated"] = True
 
-@api_bp.put("/employees/<int:employee_id>")
+
+@api_bp.route("/employees/<int:employee_id>", methods=["PUT", "PATCH"])
 @jwt_required()
 def update_employee(employee_id: int):
+    """Update only the fields present in the body.
+
+    Writes are optimistic: ``If-Match`` with a stale ETag gets 412, a stale ``version`` in the
+    body gets 409, and so does a concurrent commit that bumps the row's version first.
+    """
     requesting_user = _get_requesting_user()
     if not _is_admin(requesting_user):
         return jsonify({"message": "Administrator privileges required."}), 403
 
     employee = Employee.query.get_or_404(employee_id)
     data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"message": "Body must be a JSON object."}), 400
+
+    if request.if_match and not request.if_match.contains(_employee_etag(employee)):
+        return _employee_conflict("Employee has changed since it was fetched.", 412, employee)
+    if data.get("version") is not None:
+        try:
+            expected_version = int(data["version"])
+        except (TypeError, ValueError):
+            return jsonify({"message": "version must be an integer."}), 400
+        if expected_version != employee.version:
+            return _employee_conflict("Employee has changed since it was fetched.", 409, employee)
 
     if "name" in data:
         name = (data.get("name") or "").strip()
@@ -149,8 +601,13 @@ def update_employee(employee_id: int):
             return jsonify({"message": "leave_days must be a non-negative integer."}), 400
         employee.leave_days = leave_days_value
 
-    db.session.commit()
-    return jsonify(employee.as_dict())
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # Another writer committed between our read and the version-checked UPDATE.
+        db.session.rollback()
+        return _employee_conflict("Employee was updated concurrently.", 409, db.session.get(Employee, employee_id))
+    return _with_employee_etag(jsonify(employee.as_dict()), employee)
 
 
 @api_bp.delete("/employees/<int:employee_id>")
@@ -163,4 +620,244 @@ def delete_employee(employee_id: int):
     employee = Employee.query.get_or_404(employee_id)
     db.session.delete(employee)
     db.session.commit()
-    return jsonify({"message": "Employee deleted."})
+    return jsonify({"message": "Employee deleted."})
+
+
+@api_bp.get("/leave-requests")
+@jwt_required()
+def list_leave_requests():
+    requesting_user = _get_requesting_user()
+    if requesting_user is None:
+        return jsonify({"message": "Unknown user."}), 401
+
+    try:
+        limit = _parse_limit(request.args.get("limit"))
+        employee_id = _parse_int_arg("employee_id")
+        fields = LEAVE_REQUEST_PROJECTION.parse(request.args.get("fields"))
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    columns = LEAVE_REQUEST_PROJECTION.columns(fields, required=[LeaveRequest.requested_at, LeaveRequest.id])
+    query = db.session.query(*columns)
+    if not _is_admin(requesting_user):
+        employee_id = db.session.scalar(select(Employee.id).where(Employee.user_id == requesting_user.id))
+        if employee_id is None:
+            return jsonify({"items": [], "next_cursor": None})
+    if employee_id is not None:
+        query = query.filter(LeaveRequest.employee_id == employee_id)
+
+    status = (request.args.get("status") or "").strip().lower()
+    if status:
+        if status not in LEAVE_STATUSES:
+            return jsonify({"message": f"status must be one of: {', '.join(LEAVE_STATUSES)}."}), 400
+        query = query.filter(LeaveRequest.status == status)
+
+    try:
+        rows, next_cursor = keyset_page_desc(
+            query, LeaveRequest.requested_at, LeaveRequest.id, limit, request.args.get("after")
+        )
+    except ValueError:
+        return jsonify({"message": "after is not a valid cursor."}), 400
+    items = list(LEAVE_REQUEST_PROJECTION.serialize_all(rows, fields, columns))
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@api_bp.post("/leave-requests")
+@jwt_required()
+def create_leave_request():
+    requesting_user = _get_requesting_user()
+    if requesting_user is None:
+        return jsonify({"message": "Unknown user."}), 401
+
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"message": "Body must be a JSON object."}), 400
+    employee_id = data.get("employee_id")
+    if _is_admin(requesting_user) and employee_id is not None:
+        if not isinstance(employee_id, int) or isinstance(employee_id, bool):
+            return jsonify({"message": "employee_id must be an integer."}), 400
+        employee = db.session.get(Employee, employee_id)
+        if not employee:
+            return jsonify({"message": "Referenced employee does not exist."}), 404
+    else:
+        employee = Employee.query.filter_by(user_id=requesting_user.id).first()
+        if not employee:
+            return jsonify({"message": "Your employee profile is not set up yet."}), 400
+
+    try:
+        start_date, end_date = parse_leave_period(
+            (data.get("start_date") or "").strip(), (data.get("end_date") or "").strip()
+        )
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+    if has_overlapping_leave(employee.id, start_date, end_date):
+        return jsonify({"message": OVERLAP_MESSAGE}), 409
+
+    leave_request = submit_leave_request(employee, start_date, end_date, (data.get("reason") or "").strip())
+    return jsonify(leave_request.as_dict()), 201
+
+
+@api_bp.post("/leave-requests/decisions")
+@jwt_required()
+def decide_leave_requests_api():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+
+    data = request.get_json() or {}
+    decision = data.get("decision")
+    request_ids = data.get("ids")
+    if decision not in DECISIONS:
+        return jsonify({"message": "decision must be 'approve' or 'reject'."}), 400
+    if (
+        not isinstance(request_ids, list)
+        or not request_ids
+        or not all(isinstance(request_id, int) and not isinstance(request_id, bool) for request_id in request_ids)
+    ):
+        return jsonify({"message": "ids must be a non-empty list of integers."}), 400
+    if len(request_ids) > MAX_DECISION_BATCH:
+        return jsonify({"message": f"At most {MAX_DECISION_BATCH} ids can be decided at once."}), 400
+
+    outcomes = decide_leave_requests(request_ids, decision)
+    return jsonify(
+        {
+            "decision": decision,
+            "results": [{"id": request_id, "outcome": outcome} for request_id, outcome in outcomes.items()],
+        }
+    )
+
+
+@api_bp.get("/leave/balances")
+@jwt_required()
+def leave_balances():
+    requesting_user = _get_requesting_user()
+    if requesting_user is None:
+        return jsonify({"message": "Unknown user."}), 401
+
+    try:
+        year = _parse_int_arg("year") or date.today().year
+        employee_id = _parse_int_arg("employee_id")
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+    if not 1900 <= year <= 9999:
+        return jsonify({"message": "year is out of range."}), 400
+
+    if not _is_admin(requesting_user):
+        employee_id = db.session.scalar(select(Employee.id).where(Employee.user_id == requesting_user.id))
+        if employee_id is None:
+            return jsonify({"year": year, "items": []})
+    employee_ids = None if employee_id is None else [employee_id]
+    balances = compute_balances(year, employee_ids)
+    return jsonify({"year": year, "items": [balance.as_dict() for balance in balances]})
+
+
+@api_bp.get("/leave/coverage")
+@jwt_required()
+def leave_coverage():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+
+    try:
+        start_date = _parse_date_arg("from")
+        end_date = _parse_date_arg("to")
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+    if start_date is None or end_date is None or end_date < start_date:
+        return jsonify({"message": "from and to are required and to cannot be before from."}), 400
+    if (end_date - start_date).days >= MAX_COVERAGE_DAYS:
+        return jsonify({"message": f"Ranges are limited to {MAX_COVERAGE_DAYS} days."}), 400
+
+    intervals = get_leave_index().overlapping(start_date, end_date)
+    employee_ids = {interval.employee_id for interval in intervals}
+    names = {}
+    if employee_ids:
+        names = dict(db.session.execute(select(Employee.id, Employee.name).where(Employee.id.in_(employee_ids))).all())
+
+    # Each interval is walked only over its own clipped days, so the work is proportional to the
+    # output rather than to days x intervals.
+    day_count = (end_date - start_date).days + 1
+    first, last = clip_to_days(intervals, start_date, end_date)
+    counts = daily_counts(first, last, day_count)
+    absent_by_day = [[] for _ in range(day_count)]
+    for interval, first_day, last_day in zip(intervals, first.tolist(), last.tolist()):
+        entry = {
+            "employee_id": interval.employee_id,
+            "name": names.get(interval.employee_id),
+            "request_id": interval.request_id,
+            "status": interval.status,
+        }
+        for offset in range(first_day, last_day + 1):
+            absent_by_day[offset].append(entry)
+
+    days = [
+        {"date": (start_date + timedelta(days=offset)).isoformat(), "count": int(counts[offset]), "absent": absent}
+        for offset, absent in enumerate(absent_by_day)
+    ]
+    return jsonify({"from": start_date.isoformat(), "to": end_date.isoformat(), "days": days})
+
+
+@api_bp.get("/reports/payroll")
+@jwt_required()
+def payroll_report():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+    return jsonify(get_payroll_report())
+
+
+@api_bp.get("/audit")
+@jwt_required()
+def list_audit_events():
+    requesting_user = _get_requesting_user()
+    if not _is_admin(requesting_user):
+        return jsonify({"message": "Administrator privileges required."}), 403
+
+    try:
+        limit = _parse_limit(request.args.get("limit"))
+        entity_id = _parse_int_arg("entity_id")
+        ts_from = _parse_datetime_arg("from")
+        ts_to = _parse_datetime_arg("to")
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    entity = (request.args.get("entity") or "").strip().lower()
+    entities = sorted(audit.AUDITED_MODELS.values())
+    if entity and entity not in entities:
+        return jsonify({"message": f"entity must be one of: {', '.join(entities)}."}), 400
+    if entity_id is not None and not entity:
+        return jsonify({"message": "entity is required with entity_id."}), 400
+
+    # Make this process's buffered events visible before reading.
+    audit.flush()
+    query = AuditEvent.query
+    if entity:
+        query = query.filter(AuditEvent.entity == entity)
+    if entity_id is not None:
+        query = query.filter(AuditEvent.entity_id == entity_id)
+    if ts_from is not None:
+        query = query.filter(AuditEvent.ts >= ts_from)
+    if ts_to is not None:
+        query = query.filter(AuditEvent.ts < ts_to)
+
+    try:
+        events, next_cursor = keyset_page_desc(query, AuditEvent.ts, AuditEvent.id, limit, request.args.get("after"))
+    except ValueError:
+        return jsonify({"message": "after is not a valid cursor."}), 400
+    return jsonify({"items": [event.as_dict() for event in events], "next_cursor": next_cursor})
+
+
+@api_bp.post("/batch")
+@jwt_required()
+def batch():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "Request body must be a JSON object."}), 400
+    mode = data.get("mode") or "atomic"
+    if mode not in BATCH_MODES:
+        return jsonify({"message": f"mode must be one of: {', '.join(BATCH_MODES)}."}), 400
+    try:
+        sub_requests = parse_sub_requests(data.get("requests"), MAX_BATCH_REQUESTS)
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+    return jsonify(run_batch(sub_requests, mode))
@@ -0,0 +1,240 @@
+﻿import atexit
+import json
+import logging
+import os
+import threading
+import weakref
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from flask import current_app, g, has_app_context, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.orm import Session
+
+from . import changes, db
+from .models import AuditEvent, Employee, LeaveRequest, User
+
+
+logger = logging.getLogger(__name__)
+
+AUDITED_MODELS = {User: "user", Employee: "employee", LeaveRequest: "leave_request"}
+AUDIT_ACTIONS = ("create", "update", "delete")
+# Column values that must never be copied into the audit trail; changes are still recorded.
+REDACTED_COLUMNS = {"password_hash"}
+REDACTED = "***"
+
+_PENDING_KEY = "pending_audit"
+
+
+class AuditBuffer:
+    """Committed audit rows waiting to be written in one multi-row INSERT.
+
+    Rows are flushed when ``batch_size`` accumulate, every ``interval`` seconds by a
+    background thread, and at interpreter exit. Events still buffered when a process is
+    killed are lost, which is the price of keeping audit writes out of the request path.
+    A forked child starts with an empty buffer: the parent still owns (and writes) the rows
+    it had buffered, so ``flask serve`` flushes the master before each fork.
+    """
+
+    def __init__(self, app, batch_size: int = 200, interval: float = 2.0, background: bool = True):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.background = background
+        self._rows: List[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid: Optional[int] = None
+        _buffers.add(self)
+
+    def _after_fork_in_child(self) -> None:
+        # Drop the parent's rows so each event is written once, and replace locks that another
+        # parent thread may have held at the moment of the fork.
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def extend(self, rows: List[dict]) -> None:
+        with self._lock:
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.batch_size
+        if self.background:
+            self._start()
+            if full:
+                self._wake.set()
+        elif full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every buffered row now; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            try:
+                with self.app.app_context(), db.engine.begin() as connection:
+                    connection.execute(insert(AuditEvent.__table__), rows)
+            except Exception:
+                logger.exception("Could not write %s audit events; keeping them for the next flush", len(rows))
+                with self._lock:
+                    self._rows[:0] = rows
+                return 0
+            return len(rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def _start(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="audit-flusher", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+_buffers = weakref.WeakSet()
+
+
+def _reset_buffers_after_fork() -> None:
+    for buffer in list(_buffers):
+        buffer._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):  # pragma: no branch - missing only on Windows, which cannot fork
+    os.register_at_fork(after_in_child=_reset_buffers_after_fork)
+
+
+def init_app(app) -> None:
+    app.extensions["audit_buffer"] = AuditBuffer(
+        app,
+        batch_size=app.config["AUDIT_BATCH_SIZE"],
+        interval=app.config["AUDIT_FLUSH_INTERVAL"],
+        background=not app.config.get("TESTING"),
+    )
+
+
+def _buffer() -> Optional[AuditBuffer]:
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("audit_buffer")
+
+
+def flush() -> int:
+    buffer = _buffer()
+    return buffer.flush() if buffer is not None else 0
+
+
+def record(model: type, entity_id: int, action: str, changes: Dict[str, list], session: Optional[Session] = None) -> None:
+    """Audit a write made with a Core statement, which session events cannot see.
+
+    ``changes`` maps column names to ``[before, after]``. The event is kept only if the
+    surrounding transaction commits.
+    """
+    session = session or db.session()
+    session.info.setdefault(_PENDING_KEY, []).append(_event(AUDITED_MODELS[model], entity_id, action, changes))
+
+
+def _event(entity: str, entity_id: int, action: str, changes: Dict[str, list]) -> dict:
+    return {
+        "ts": datetime.utcnow(),
+        "entity": entity,
+        "entity_id": entity_id,
+        "action": action,
+        "actor_id": _actor_id(),
+        "changes": json.dumps(changes, default=_json_default, sort_keys=True),
+    }
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _actor_id() -> Optional[int]:
+    if not has_request_context():
+        return None
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        identity = None
+    if identity is not None:
+        return int(identity)
+    # Only use a web user Flask-Login has already loaded: this runs inside a flush, where
+    # loading one would query through the flushing session.
+    user = g.get("_login_user")
+    if user is not None and user.is_authenticated:
+        return user.id
+    return None
+
+
+def _value(key: str, value):
+    return REDACTED if key in REDACTED_COLUMNS and value is not None else value
+
+
+def _diff(instance, action: str) -> Dict[str, list]:
+    state = inspect(instance)
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        key = attr.key
+        if action == "create":
+            value = state.dict.get(key)
+            if value is not None:
+                changes[key] = [None, _value(key, value)]
+        elif action == "delete":
+            if key in state.dict:
+                changes[key] = [_value(key, state.dict[key]), None]
+        else:
+            history = state.attrs[key].history
+            if history.has_changes():
+                before = history.deleted[0] if history.deleted else None
+                after = history.added[0] if history.added else None
+                if before != after:
+                    changes[key] = [_value(key, before), _value(key, after)]
+    return changes
+
+
+@event.listens_for(Session, "after_flush")
+def _capture(session: Session, flush_context) -> None:
+    events = []
+    for instances, action in ((session.new, "create"), (session.dirty, "update"), (session.deleted, "delete")):
+        for instance in instances:
+            entity = AUDITED_MODELS.get(type(instance))
+            if entity is None:
+                continue
+            changes = _diff(instance, action)
+            if changes or action != "update":
+                # New rows are still pending here, so read the key from the instance itself.
+                entity_id = inspect(instance).mapper.primary_key_from_instance(instance)[0]
+                events.append(_event(entity, entity_id, action, changes))
+    if events:
+        session.info.setdefault(_PENDING_KEY, []).extend(events)
+
+
+@event.listens_for(Session, "after_commit")
+def _hand_off(session: Session) -> None:
+    events = session.info.pop(_PENDING_KEY, None)
+    if not events:
+        return
+    buffer = _buffer()
+    if buffer is not None:
+        changes.when_committed(session, lambda: buffer.extend(events))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -1,19 +1,47 @@
-﻿from flask import Blueprint, flash, jsonify, redirect, render_template, request, url_for
+﻿import secrets
+from typing import Optional
+
+from flask import Blueprint, flash, jsonify, make_response, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
-from flask_jwt_extended import create_access_token
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, get_jwt, get_jwt_identity, jwt_required
+from jwt import InvalidTokenError
+from werkzeug.security import check_password_hash, generate_password_hash
 
 from . import db
+from .metrics import time_password_hash
 from .models import User
+from .principals import get_principal
+from .tokens import revoke_token
+from .throttle import check_login_attempt
 
 
 auth_bp = Blueprint("auth", __name__)
 api_auth_bp = Blueprint("api_auth", __name__, url_prefix="/api/auth")
 
 
+# Hashed once at import (in the master, under preload) so every unknown-username login does
+# exactly one KDF run, the same as a real password check.
+_DUMMY_PASSWORD_HASH = generate_password_hash(secrets.token_urlsafe())
+
+
 def _current_user_is_admin() -> bool:
     return current_user.is_authenticated and (current_user.role or "").lower() == "admin"
 
 
+def _authenticate(username: str, password: str) -> Optional[User]:
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        # Do the same KDF work as a real check so response times do not reveal which usernames exist.
+        with time_password_hash("check"):
+            check_password_hash(_DUMMY_PASSWORD_HASH, password)
+        return None
+    return user if user.check_password(password) else None
+
+
+def _throttled_message(retry_after: int) -> str:
+    return f"Too many login attempts. Try again in {retry_after} seconds."
+
+
 @auth_bp.route("/register", methods=["GET", "POST"])
 def register():
     total_users = User.query.count()
@@ -60,8 +88,15 @@ def login():
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "").strip()
 
-        user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password):
+        retry_after = check_login_attempt(username)
+        if retry_after is not None:
+            flash(_throttled_message(retry_after), "danger")
+            response = make_response(render_template("login.html"), 429)
+            response.headers["Retry-After"] = str(retry_after)
+            return response
+
+        user = _authenticate(username, password)
+        if user:
             login_user(user)
             flash("Logged in successfully.", "success")
             return redirect(url_for("main.dashboard"))
@@ -105,9 +140,50 @@ def api_login():
     username = (data.get("username") or "").strip()
     password = (data.get("password") or "").strip()
 
-    user = User.query.filter_by(username=username).first()
-    if not user or not user.check_password(password):
+    retry_after = check_login_attempt(username)
+    if retry_after is not None:
+        return jsonify({"message": _throttled_message(retry_after)}), 429, {"Retry-After": str(retry_after)}
+
+    user = _authenticate(username, password)
+    if not user:
         return jsonify({"message": "Invalid credentials."}), 401
 
-    token = create_access_token(identity=str(user.id), additional_claims={"username": user.username, "role": user.role})
-    return jsonify({"access_token": token, "user": {"username": user.username, "role": user.role}})
+    return jsonify(
+        {
+            "access_token": _access_token(user),
+            "refresh_token": create_refresh_token(identity=str(user.id)),
+            "user": {"username": user.username, "role": user.role},
+        }
+    )
+
+
+def _access_token(user) -> str:
+    return create_access_token(identity=str(user.id), additional_claims={"username": user.username, "role": user.role})
+
+
+@api_auth_bp.post("/refresh")
+@jwt_required(refresh=True)
+def api_refresh():
+    # Claims come from the current user row, so a refreshed token never carries a stale role.
+    principal = get_principal(int(get_jwt_identity()))
+    if principal is None:
+        return jsonify({"message": "Unknown user."}), 401
+    return jsonify({"access_token": _access_token(principal)})
+
+
+@api_auth_bp.post("/logout")
+@jwt_required(verify_type=False)
+def api_logout():
+    """Revoke the presented token, and the refresh token in the body if one is given."""
+    revoke_token(get_jwt())
+    refresh_token = ((request.get_json(silent=True) or {}).get("refresh_token") or "").strip()
+    if refresh_token:
+        try:
+            payload = decode_token(refresh_token, allow_expired=True)
+        except InvalidTokenError:
+            return jsonify({"message": "refresh_token is not a valid token."}), 400
+        if payload.get("sub") != get_jwt_identity():
+            return jsonify({"message": "refresh_token belongs to another user."}), 400
+        revoke_token(payload)
+    db.session.commit()
+    return jsonify({"message": "Logged out."})
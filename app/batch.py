@@ -0,0 +1,150 @@
+﻿import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from flask import current_app, request
+from werkzeug.test import EnvironBuilder
+
+from . import changes, db
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_MODES = ("atomic", "best_effort")
+SUB_REQUEST_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+# Sub-requests left unrun after an atomic batch fails are reported as 424 Failed Dependency.
+SKIPPED_STATUS = 424
+
+
+@dataclass(frozen=True)
+class SubRequest:
+    method: str
+    path: str
+    body: Optional[object]
+    headers: dict
+
+
+def parse_sub_requests(items, max_requests: int) -> List[SubRequest]:
+    """Validate the ``requests`` array of a batch; raises ValueError with a client message."""
+    if not isinstance(items, list) or not items:
+        raise ValueError("requests must be a non-empty list.")
+    if len(items) > max_requests:
+        raise ValueError(f"A batch may contain at most {max_requests} requests.")
+    sub_requests = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"requests[{index}] must be an object.")
+        method = str(item.get("method") or "GET").upper()
+        path = str(item.get("path") or "")
+        if method not in SUB_REQUEST_METHODS:
+            raise ValueError(f"requests[{index}].method must be one of: {', '.join(sorted(SUB_REQUEST_METHODS))}.")
+        if not path.startswith("/api/") or path.split("?", 1)[0].rstrip("/") == "/api/batch":
+            raise ValueError(f"requests[{index}].path must be an /api/ path other than /api/batch.")
+        headers = item.get("headers") or {}
+        if not isinstance(headers, dict):
+            raise ValueError(f"requests[{index}].headers must be an object.")
+        sub_requests.append(SubRequest(method, path, item.get("body"), {str(k): str(v) for k, v in headers.items()}))
+    return sub_requests
+
+
+def run_batch(sub_requests: List[SubRequest], mode: str) -> dict:
+    """Dispatch ``sub_requests`` in order through the normal handlers, in one transaction.
+
+    Every sub-request gets its own app and request context, so handlers, JWT checks and
+    after_request hooks behave exactly as for a standalone call, but each context's session
+    is bound to one shared connection and joins its transaction through a SAVEPOINT. A
+    handler's ``db.session.commit()`` therefore only releases its savepoint. In ``atomic``
+    mode the first 4xx/5xx rolls everything back and the rest are skipped; in
+    ``best_effort`` mode only the failing sub-request's savepoint is rolled back. Commit
+    side effects (cache invalidation, audit hand-off, job wake-ups) are held back until
+    the outer transaction commits.
+    """
+    app = current_app._get_current_object()
+    inherited_headers = {"Authorization": request.headers["Authorization"]} if "Authorization" in request.headers else {}
+    # Sub-requests come from the caller's address, so per-IP limits such as the login throttle
+    # count them in the caller's own bucket. Sub-requests cannot override these.
+    client_environ = {"REMOTE_ADDR": request.remote_addr}
+    client_headers = {"X-Forwarded-For": request.headers["X-Forwarded-For"]} if "X-Forwarded-For" in request.headers else {}
+    # The batch request's own session is done; release its connection before opening ours.
+    db.session.close()
+
+    responses = []
+    effects: List[Callable[[], None]] = []
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    if connection.dialect.name == "sqlite":
+        # pysqlite defers BEGIN until the first write, and SQLite commits a SAVEPOINT that
+        # opened the transaction as soon as it is released; start the transaction explicitly.
+        connection.exec_driver_sql("BEGIN")
+    failed = False
+    try:
+        for sub_request in sub_requests:
+            if failed:
+                responses.append({"status": SKIPPED_STATUS, "body": {"message": "Skipped after an earlier request failed."}})
+                continue
+            savepoint = connection.begin_nested()
+            sub_effects: List[Callable[[], None]] = []
+            headers = {**inherited_headers, **sub_request.headers, **client_headers}
+            status, body = _dispatch(app, connection, sub_request, headers, client_environ, sub_effects)
+            if status < 400:
+                if savepoint.is_active:
+                    savepoint.commit()
+                effects.extend(sub_effects)
+            else:
+                if savepoint.is_active:
+                    savepoint.rollback()
+                failed = mode == "atomic"
+            responses.append({"status": status, "body": body})
+
+        if failed:
+            transaction.rollback()
+        else:
+            transaction.commit()
+    except Exception:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+
+    committed = not failed
+    if committed:
+        for effect in effects:
+            effect()
+    return {"mode": mode, "committed": committed, "responses": responses}
+
+
+def _dispatch(app, connection, sub_request: SubRequest, headers: dict, environ_base: dict, effects: list):
+    builder = EnvironBuilder(
+        path=sub_request.path,
+        method=sub_request.method,
+        headers=headers,
+        json=sub_request.body,
+        environ_base=environ_base,
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+
+    with app.app_context():
+        session = db.session.session_factory(bind=connection, join_transaction_mode="create_savepoint")
+        changes.defer_commit_effects(session, effects)
+        db.session.registry.set(session)
+        with app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+            except Exception:
+                logger.exception("Batch sub-request %s %s failed", sub_request.method, sub_request.path)
+                db.session.rollback()
+                return 500, {"message": "Internal server error."}
+            data = response.get_data()
+            status = response.status_code
+            if response.is_json:
+                body = response.get_json()
+            elif not data:
+                body = None
+            else:
+                body = data.decode("utf-8", errors="replace")
+            if status >= 400 and session.in_transaction():
+                session.rollback()
+            return status, body
@@ -0,0 +1,195 @@
+﻿import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional
+
+import click
+import numpy as np
+from flask import current_app
+from sqlalchemy import event
+
+from . import db
+from .models import User
+
+
+BENCH_USERNAME = "bench-admin"
+BENCH_PASSWORD = "bench-password"
+
+# Budgets for 10k employees / 500k leave requests on a single SQLite file (`flask synth`
+# defaults): the worst of three measured runs plus ~30%, with a few milliseconds of floor for
+# the sub-5ms endpoints and one spare query for a principal cache refresh. A run that exceeds
+# any of them is reported as a regression; re-measure and update them when the data shape changes.
+DEFAULT_THRESHOLDS: Dict[str, Dict[str, float]] = {
+    "auth.login": {"p95_ms": 200, "max_queries": 2, "peak_kib": 128},
+    "employees.list": {"p95_ms": 10, "max_queries": 3, "peak_kib": 256},
+    "employees.search": {"p95_ms": 5, "max_queries": 1, "peak_kib": 128},
+    "leave_requests.list": {"p95_ms": 10, "max_queries": 2, "peak_kib": 256},
+    "leave.balances": {"p95_ms": 2000, "max_queries": 4, "peak_kib": 12288},
+    "reports.payroll": {"p95_ms": 10, "max_queries": 2, "peak_kib": 64},
+    "web.dashboard": {"p95_ms": 1500, "max_queries": 4, "peak_kib": 65536},
+}
+
+
+@dataclass
+class EndpointResult:
+    name: str
+    samples_ms: List[float] = field(repr=False)
+    queries: List[int] = field(repr=False)
+    peak_kib: float
+    statuses: List[int] = field(repr=False)
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self.samples_ms, q))
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "requests": len(self.samples_ms),
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "mean_queries": round(sum(self.queries) / len(self.queries), 2),
+            "max_queries": max(self.queries),
+            "peak_kib": round(self.peak_kib, 1),
+            "errors": sum(1 for status in self.statuses if status >= 400),
+        }
+
+
+def _endpoints(token: str) -> Dict[str, dict]:
+    auth = {"Authorization": f"Bearer {token}"}
+    return {
+        "auth.login": {"method": "POST", "path": "/api/auth/login", "json": {"username": BENCH_USERNAME, "password": BENCH_PASSWORD}},
+        "employees.list": {"method": "GET", "path": "/api/employees?limit=50", "headers": auth},
+        "employees.search": {"method": "GET", "path": "/api/employees/search?q=mensah", "headers": auth},
+        "leave_requests.list": {"method": "GET", "path": "/api/leave-requests?status=pending&limit=50", "headers": auth},
+        "leave.balances": {"method": "GET", "path": f"/api/leave/balances?year={date.today().year}", "headers": auth},
+        "reports.payroll": {"method": "GET", "path": "/api/reports/payroll", "headers": auth},
+        "web.dashboard": {"method": "GET", "path": "/", "web": True},
+    }
+
+
+def _ensure_bench_user() -> None:
+    user = User.query.filter_by(username=BENCH_USERNAME).first()
+    if user is None:
+        user = User(username=BENCH_USERNAME, role="admin")
+        user.set_password(BENCH_PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+
+
+def run_benchmarks(app, iterations: int = 50, warmup: int = 3, memory_iterations: int = 3, only: Optional[List[str]] = None) -> List[EndpointResult]:
+    """Time each endpoint through the test client and count its SQL statements.
+
+    Latency is measured without tracing; peak memory comes from a few extra requests under
+    tracemalloc, which would otherwise distort the timings.
+    """
+    with app.app_context():
+        _ensure_bench_user()
+    # Measure the cost of a login itself, not the throttle turning repeated attempts away.
+    throttle_enabled = app.config["LOGIN_THROTTLE_ENABLED"]
+    app.config["LOGIN_THROTTLE_ENABLED"] = False
+    try:
+        return _run(app, iterations, warmup, memory_iterations, only)
+    finally:
+        app.config["LOGIN_THROTTLE_ENABLED"] = throttle_enabled
+
+
+def _run(app, iterations: int, warmup: int, memory_iterations: int, only: Optional[List[str]]) -> List[EndpointResult]:
+    with app.app_context():
+        engines = [db.engine] + [engine for engine in [app.extensions.get("read_engine")] if engine is not None]
+
+    api_client = app.test_client()
+    token = api_client.post("/api/auth/login", json={"username": BENCH_USERNAME, "password": BENCH_PASSWORD}).get_json()["access_token"]
+    web_client = app.test_client()
+    web_client.post("/login", data={"username": BENCH_USERNAME, "password": BENCH_PASSWORD})
+
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _count)
+    results = []
+    try:
+        for name, spec in _endpoints(token).items():
+            if only and name not in only:
+                continue
+            client = web_client if spec.get("web") else api_client
+
+            def call():
+                return client.open(spec["path"], method=spec["method"], json=spec.get("json"), headers=spec.get("headers"))
+
+            for _ in range(warmup):
+                call()
+            samples, queries, statuses = [], [], []
+            for _ in range(iterations):
+                statements.clear()
+                started = time.perf_counter()
+                response = call()
+                samples.append((time.perf_counter() - started) * 1000)
+                queries.append(len(statements))
+                statuses.append(response.status_code)
+
+            tracemalloc.start()
+            peak = 0
+            try:
+                for _ in range(memory_iterations):
+                    tracemalloc.reset_peak()
+                    call()
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+            results.append(EndpointResult(name, samples, queries, peak / 1024, statuses))
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", _count)
+    return results
+
+
+def check_thresholds(results: List[EndpointResult], thresholds: Dict[str, Dict[str, float]]) -> List[str]:
+    """Return a message for every budget an endpoint exceeded, and for any failed request."""
+    violations = []
+    for result in results:
+        summary = result.summary()
+        if summary["errors"]:
+            violations.append(f"{result.name}: {summary['errors']} requests failed")
+        for metric, limit in thresholds.get(result.name, {}).items():
+            if summary[metric] > limit:
+                violations.append(f"{result.name}: {metric} {summary[metric]} exceeds {limit}")
+    return violations
+
+
+def format_table(results: List[EndpointResult]) -> str:
+    columns = ("name", "requests", "p50_ms", "p95_ms", "p99_ms", "mean_queries", "max_queries", "peak_kib", "errors")
+    rows = [columns] + [tuple(str(result.summary()[column]) for column in columns) for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def init_app(app) -> None:
+    @app.cli.command("bench")
+    @click.option("--iterations", "-n", type=int, default=50, show_default=True)
+    @click.option("--warmup", type=int, default=3, show_default=True)
+    @click.option("--endpoint", "endpoints", multiple=True, help="Only benchmark these endpoints (repeatable).")
+    @click.option("--thresholds", "thresholds_path", type=click.Path(exists=True, dir_okay=False), help="JSON file of per-endpoint budgets.")
+    @click.option("--json", "json_path", type=click.Path(dir_okay=False), help="Also write the results to this file.")
+    def bench(iterations, warmup, endpoints, thresholds_path, json_path):
+        """Benchmark the main endpoints and fail if any exceeds its budget."""
+        thresholds = DEFAULT_THRESHOLDS
+        if thresholds_path:
+            with open(thresholds_path, encoding="utf-8") as handle:
+                thresholds = json.load(handle)
+
+        results = run_benchmarks(current_app._get_current_object(), iterations=iterations, warmup=warmup, only=list(endpoints) or None)
+        click.echo(format_table(results))
+        violations = check_thresholds(results, thresholds)
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as handle:
+                json.dump({"results": [result.summary() for result in results], "violations": violations}, handle, indent=2)
+        if violations:
+            for violation in violations:
+                click.echo(f"REGRESSION {violation}", err=True)
+            raise SystemExit(1)
@@ -0,0 +1,118 @@
+﻿from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import db
+
+
+# Maps a model class to the primary keys written in the current transaction. ``None`` means
+# "some rows changed, ids unknown" (bulk INSERT/UPDATE statements that bypass the unit of work).
+ChangeSet = Dict[type, Optional[Set]]
+
+_PENDING_KEY = "pending_changes"
+_DEFERRED_KEY = "deferred_commit_effects"
+_hooks: List[Tuple[frozenset, Callable[[ChangeSet], None]]] = []
+_before_commit_hooks: List[Tuple[frozenset, Callable[[Session, ChangeSet], None]]] = []
+
+
+def on_commit(*models: type):
+    """Register ``func(changes)`` to run after a commit that wrote any of ``models``."""
+
+    def decorator(func: Callable[[ChangeSet], None]) -> Callable[[ChangeSet], None]:
+        _hooks.append((frozenset(models), func))
+        return func
+
+    return decorator
+
+
+def before_commit(*models: type):
+    """Register ``func(session, changes)`` to run inside the transaction, just before it commits.
+
+    Use this for bookkeeping that must commit atomically with the writes it describes.
+    """
+
+    def decorator(func: Callable[[Session, ChangeSet], None]) -> Callable[[Session, ChangeSet], None]:
+        _before_commit_hooks.append((frozenset(models), func))
+        return func
+
+    return decorator
+
+
+def defer_commit_effects(session: Session, effects: List[Callable[[], None]]) -> None:
+    """Collect ``session``'s post-commit side effects in ``effects`` instead of running them.
+
+    Used when the session only commits a SAVEPOINT of an outer transaction: the caller runs
+    ``effects`` once the outer transaction really commits, or drops them on rollback.
+    """
+    session.info[_DEFERRED_KEY] = effects
+
+
+def when_committed(session: Session, effect: Callable[[], None]) -> None:
+    """Run ``effect`` now, or after the outer commit if the session's effects are deferred."""
+    deferred = session.info.get(_DEFERRED_KEY)
+    if deferred is None:
+        effect()
+    else:
+        deferred.append(effect)
+
+
+def mark(model: type, ids: Optional[Iterable] = None, session: Optional[Session] = None) -> None:
+    """Record writes made with Core statements so commit hooks still see them."""
+    session = session or db.session()
+    _record(session, model, None if ids is None else set(ids))
+
+
+def _record(session: Session, model: type, ids: Optional[Set]) -> None:
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    if ids is None or (model in pending and pending[model] is None):
+        pending[model] = None
+    else:
+        pending.setdefault(model, set()).update(ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session: Session, flush_context) -> None:
+    # Objects that are only dirty through a relationship (e.g. a backref collection append) did
+    # not write their own row, so they are left out of the change set.
+    modified = (instance for instance in session.dirty if session.is_modified(instance, include_collections=False))
+    for instance in (*session.new, *modified, *session.deleted):
+        # New rows have no identity key until after the flush completes, so read the primary key
+        # the INSERT just assigned straight from the instance.
+        key = inspect(instance).mapper.primary_key_from_instance(instance)
+        _record(session, type(instance), {key[0] if len(key) == 1 else tuple(key)})
+
+
+@event.listens_for(Session, "before_commit")
+def _run_before_commit_hooks(session: Session) -> None:
+    if not _before_commit_hooks:
+        return
+    # Flush first so writes still sitting in the unit of work are part of the change set.
+    session.flush()
+    changes = session.info.get(_PENDING_KEY)
+    if not changes:
+        return
+    changed_models = set(changes)
+    for models, func in _before_commit_hooks:
+        if models & changed_models:
+            func(session, {model: ids for model, ids in changes.items() if model in models})
+
+
+@event.listens_for(Session, "after_commit")
+def _run_hooks(session: Session) -> None:
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    when_committed(session, lambda: _call_hooks(changes))
+
+
+def _call_hooks(changes: ChangeSet) -> None:
+    changed_models = set(changes)
+    for models, func in _hooks:
+        if models & changed_models:
+            func({model: ids for model, ids in changes.items() if model in models})
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,155 @@
+﻿import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+from . import changes, db
+from .leave import BOOKED_STATUSES
+from .models import LeaveRequest
+
+
+@dataclass(frozen=True)
+class LeaveInterval:
+    request_id: int
+    employee_id: int
+    start: date
+    end: date
+    status: str
+
+
+class SortedIntervals:
+    """Intervals kept sorted by start date, plus the length of the longest one held.
+
+    Anything overlapping ``[start, end]`` must begin in ``[start - max_length, end]``, so a
+    query is two bisects and a scan of that window rather than of every interval. Leave is
+    short compared with the history it sits in, which keeps the window small. Lengths are
+    counted so that removing the longest interval shrinks the window again.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._intervals: Dict[int, LeaveInterval] = {}
+        self._length_counts: Dict[int, int] = {}
+        self._max_length = 0
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def add(self, interval: LeaveInterval) -> None:
+        self.remove(interval.request_id)
+        insort(self._keys, (interval.start.toordinal(), interval.request_id))
+        self._intervals[interval.request_id] = interval
+        length = _length(interval)
+        self._length_counts[length] = self._length_counts.get(length, 0) + 1
+        self._max_length = max(self._max_length, length)
+
+    def remove(self, request_id: int) -> Optional[LeaveInterval]:
+        interval = self._intervals.pop(request_id, None)
+        if interval is not None:
+            key = (interval.start.toordinal(), request_id)
+            del self._keys[bisect_left(self._keys, key)]
+            length = _length(interval)
+            self._length_counts[length] -= 1
+            if not self._length_counts[length]:
+                del self._length_counts[length]
+                if length == self._max_length:
+                    self._max_length = max(self._length_counts, default=0)
+        return interval
+
+    def overlapping(self, start: date, end: date) -> List[LeaveInterval]:
+        low = bisect_left(self._keys, (start.toordinal() - self._max_length,))
+        high = bisect_right(self._keys, (end.toordinal(), float("inf")))
+        candidates = (self._intervals[request_id] for _, request_id in self._keys[low:high])
+        return [interval for interval in candidates if interval.end >= start]
+
+
+def clip_to_days(intervals: Sequence[LeaveInterval], start: date, end: date) -> Tuple[np.ndarray, np.ndarray]:
+    """Return each interval's first and last day as offsets from ``start``, clipped to ``[start, end]``."""
+    origin = start.toordinal()
+    first = np.fromiter((interval.start.toordinal() for interval in intervals), dtype=np.int64, count=len(intervals))
+    last = np.fromiter((interval.end.toordinal() for interval in intervals), dtype=np.int64, count=len(intervals))
+    return np.maximum(first, origin) - origin, np.minimum(last, end.toordinal()) - origin
+
+
+def daily_counts(first: np.ndarray, last: np.ndarray, days: int) -> np.ndarray:
+    """Count the intervals covering each of ``days`` days with a difference array."""
+    delta = np.zeros(days + 1, dtype=np.int64)
+    np.add.at(delta, first, 1)
+    np.add.at(delta, last + 1, -1)
+    return np.cumsum(delta[:-1])
+
+
+def _length(interval: LeaveInterval) -> int:
+    return interval.end.toordinal() - interval.start.toordinal()
+
+
+class LeaveIndex:
+    """In-memory index of booked (pending or approved) leave, one per app, for coverage reads.
+
+    Built from a single column query on first use. Commits that touch LeaveRequest mark the
+    affected ids stale and the next lookup re-reads only those rows. ``ttl`` bounds how long
+    writes made by other worker processes can go unseen, which is why overlap checks for new
+    requests query the database instead (see ``leave.has_overlapping_leave``).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._all = SortedIntervals()
+        self._loaded_at = None
+        self._stale_ids = set()
+
+    def invalidate(self, request_ids=None) -> None:
+        with self._lock:
+            if request_ids is None:
+                self._loaded_at = None
+            else:
+                self._stale_ids.update(request_ids)
+
+    def overlapping(self, start: date, end: date) -> List[LeaveInterval]:
+        with self._lock:
+            self._refresh()
+            return self._all.overlapping(start, end)
+
+    def _refresh(self) -> None:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._all = SortedIntervals()
+            self._stale_ids.clear()
+            for row in db.session.execute(_interval_query()):
+                self._all.add(LeaveInterval(*row))
+            self._loaded_at = time.monotonic()
+            return
+
+        if self._stale_ids:
+            stale_ids, self._stale_ids = self._stale_ids, set()
+            for request_id in stale_ids:
+                self._all.remove(request_id)
+            for row in db.session.execute(_interval_query().where(LeaveRequest.id.in_(stale_ids))):
+                self._all.add(LeaveInterval(*row))
+
+
+def _interval_query():
+    return select(
+        LeaveRequest.id, LeaveRequest.employee_id, LeaveRequest.start_date, LeaveRequest.end_date, LeaveRequest.status
+    ).where(LeaveRequest.status.in_(BOOKED_STATUSES))
+
+
+def init_app(app) -> None:
+    app.extensions["leave_index"] = LeaveIndex(ttl=app.config["LEAVE_INDEX_TTL"])
+
+
+def get_leave_index() -> LeaveIndex:
+    return current_app.extensions["leave_index"]
+
+
+@changes.on_commit(LeaveRequest)
+def _mark_stale(changed) -> None:
+    index = current_app.extensions.get("leave_index")
+    if index is not None:
+        index.invalidate(changed[LeaveRequest])
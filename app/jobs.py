@@ -0,0 +1,254 @@
+﻿import json
+import logging
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import click
+from flask import current_app, has_app_context
+from sqlalchemy import and_, or_, select, update
+
+from . import changes, db
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+HANDLERS: Dict[str, Callable[..., None]] = {}
+
+
+def handler(name: str):
+    """Register ``func(**payload)`` as the handler for jobs called ``name``."""
+
+    def decorator(func: Callable[..., None]) -> Callable[..., None]:
+        HANDLERS[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name: str, *, delay: float = 0, max_attempts: Optional[int] = None, **payload) -> Job:
+    """Add a job to the current transaction.
+
+    The job row commits atomically with the caller's writes and the worker is woken after
+    ``db.session.commit()``; a rollback discards the job along with everything else.
+    """
+    if name not in HANDLERS:
+        raise ValueError(f"Unknown job {name!r}.")
+    now = datetime.utcnow()
+    job = Job(
+        name=name,
+        payload=json.dumps(payload, default=str),
+        run_at=now + timedelta(seconds=delay),
+        max_attempts=max_attempts or current_app.config["JOB_MAX_ATTEMPTS"],
+        created_at=now,
+        updated_at=now,
+    )
+    db.session.add(job)
+    return job
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff after the ``attempts``-th failure, capped at JOB_RETRY_MAX_DELAY."""
+    config = current_app.config
+    seconds = min(config["JOB_RETRY_BASE_DELAY"] * 2 ** (attempts - 1), config["JOB_RETRY_MAX_DELAY"])
+    return timedelta(seconds=seconds)
+
+
+def claim_jobs(limit: int) -> List:
+    """Mark up to ``limit`` due jobs as running and return them, in one UPDATE ... RETURNING.
+
+    Jobs left ``running`` for longer than JOB_LEASE_SECONDS (their worker died) are claimed
+    again. The claim condition is repeated on the outer UPDATE so concurrent workers in
+    other processes cannot claim the same row twice.
+    """
+    now = datetime.utcnow()
+    claimable = or_(
+        and_(Job.status == "queued", Job.run_at <= now),
+        and_(Job.status == "running", Job.updated_at < now - timedelta(seconds=current_app.config["JOB_LEASE_SECONDS"])),
+    )
+    due = select(Job.id).where(claimable).order_by(Job.run_at, Job.id).limit(limit)
+    rows = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(due.scalar_subquery()), claimable)
+        .values(status="running", attempts=Job.attempts + 1, updated_at=now)
+        .returning(Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return rows
+
+
+def run_job(row) -> str:
+    """Run one claimed job and record the outcome: ``done``, ``queued`` (retry) or ``failed``."""
+    try:
+        func = HANDLERS.get(row.name)
+        if func is None:
+            raise LookupError(f"No handler registered for job {row.name!r}.")
+        func(**json.loads(row.payload))
+        # The handler's writes and the completion mark commit together.
+        _set_job(row.id, status="done", last_error=None)
+        db.session.commit()
+        return "done"
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed on attempt %s", row.id, row.name, row.attempts)
+        error = f"{type(exc).__name__}: {exc}"
+        if row.attempts >= row.max_attempts:
+            _set_job(row.id, status="failed", last_error=error)
+            status = "failed"
+        else:
+            _set_job(row.id, status="queued", last_error=error, run_at=datetime.utcnow() + retry_delay(row.attempts))
+            status = "queued"
+        db.session.commit()
+        return status
+
+
+def run_pending(limit: int = 100) -> Dict[int, str]:
+    """Run due jobs in the calling thread until none are left; returns ``{job id: outcome}``."""
+    outcomes = {}
+    while True:
+        rows = claim_jobs(limit)
+        if not rows:
+            return outcomes
+        for row in rows:
+            outcomes[row.id] = run_job(row)
+
+
+def _set_job(job_id: int, **values) -> None:
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class JobWorker:
+    """Dispatcher thread feeding claimed jobs to a thread pool.
+
+    ``flask serve`` starts one in each server worker right after it forks, so no worker
+    inherits dead threads from the master. ``flask jobs`` runs one as a dedicated process.
+    """
+
+    def __init__(self, app, threads: int = 2, poll_interval: float = 5.0):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pid: Optional[int] = None
+        self._in_flight = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._in_flight = 0
+            self._stop.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="job")
+            self._thread = threading.Thread(target=self._dispatch, name="job-dispatcher", daemon=True)
+            self._thread.start()
+
+    def wake(self) -> None:
+        # Only a pool started in this process has a dispatcher to wake; otherwise the job waits
+        # for the next poll of whichever process runs one.
+        if self._pid == os.getpid():
+            self._wake.set()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        self._pid = None
+
+    def _dispatch(self) -> None:
+        while not self._stop.is_set():
+            with self._lock:
+                free = self.threads - self._in_flight
+            rows = []
+            if free > 0:
+                try:
+                    with self.app.app_context():
+                        rows = claim_jobs(free)
+                except Exception:
+                    logger.exception("Could not claim jobs")
+            for row in rows:
+                with self._lock:
+                    self._in_flight += 1
+                self._executor.submit(self._run, row)
+            if len(rows) < free or free <= 0:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _run(self, row) -> None:
+        try:
+            with self.app.app_context():
+                run_job(row)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._wake.set()
+
+
+def _build_worker(app) -> JobWorker:
+    return JobWorker(app, threads=app.config["JOB_WORKER_THREADS"], poll_interval=app.config["JOB_POLL_INTERVAL"])
+
+
+def init_app(app) -> None:
+    worker = None
+    if app.config["JOB_WORKER_ENABLED"] and not app.config.get("TESTING"):
+        worker = _build_worker(app)
+    app.extensions["job_worker"] = worker
+
+    @app.cli.command("jobs")
+    def run_worker():
+        """Process background jobs in this process until interrupted.
+
+        Run it beside the development server, or run one copy with JOB_WORKER_ENABLED=false
+        on the web servers so only this process polls the job table.
+        """
+        dedicated = _build_worker(app)
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+        dedicated.start()
+        click.echo(f"Job worker running with {dedicated.threads} threads (pid {os.getpid()})")
+        try:
+            while not stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dedicated.stop()
+
+
+def start_worker(app) -> None:
+    """Start ``app``'s job pool in the current process, if it has one."""
+    worker = app.extensions.get("job_worker")
+    if worker is not None:
+        worker.start()
+
+
+def _worker() -> Optional[JobWorker]:
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("job_worker")
+
+
+@changes.on_commit(Job)
+def _wake_worker(changed) -> None:
+    worker = _worker()
+    if worker is not None:
+        worker.wake()
@@ -0,0 +1,229 @@
+﻿import logging
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, update
+
+from . import audit, changes, db, jobs
+from .models import Employee, LeaveRequest
+
+
+# Notifications are written to this logger until a mail/chat transport is configured.
+notifications = logging.getLogger("app.notifications")
+
+
+DECISIONS = {"approve": "approved", "reject": "rejected"}
+LEAVE_STATUSES = ("pending", "approved", "rejected")
+# Statuses that draw on an employee's allowance; pending days are reported separately.
+BOOKED_STATUSES = ("approved", "pending")
+
+
+@dataclass(frozen=True)
+class LeaveBalance:
+    employee_id: int
+    year: int
+    entitlement: int
+    used: int
+    pending: int
+    remaining: int
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def init_app(app) -> None:
+    holidays = [date.fromisoformat(value) for value in app.config["LEAVE_HOLIDAYS"]]
+    app.extensions["leave_calendar"] = np.busdaycalendar(
+        weekmask=app.config["LEAVE_WEEKMASK"], holidays=np.array(holidays, dtype="datetime64[D]")
+    )
+
+
+def parse_leave_period(start_date_str: str, end_date_str: str) -> Tuple[date, date]:
+    """Validate a submitted leave range; raises ValueError with a user-facing message."""
+    if not start_date_str or not end_date_str:
+        raise ValueError("Start and end dates are required.")
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
+        if end_date < start_date:
+            raise ValueError
+    except ValueError:
+        raise ValueError(
+            "Please provide valid start and end dates (end date cannot be before start date)."
+        ) from None
+    return start_date, end_date
+
+
+OVERLAP_MESSAGE = "You already have leave booked that overlaps these dates."
+
+
+def has_overlapping_leave(employee_id: int, start_date: date, end_date: date) -> bool:
+    """Check the database for pending or approved leave overlapping ``[start_date, end_date]``.
+
+    Call this in the transaction that inserts the new request (``submit_leave_request`` commits
+    it). The employee row is locked first so concurrent submissions for the same employee queue
+    behind each other. SQLite ignores FOR UPDATE but runs one write transaction at a time, so a
+    second submission that read before the first committed fails instead of double-booking.
+    """
+    db.session.execute(select(Employee.id).where(Employee.id == employee_id).with_for_update())
+    overlap = db.session.scalar(
+        select(LeaveRequest.id)
+        .where(
+            LeaveRequest.employee_id == employee_id,
+            LeaveRequest.start_date <= end_date,
+            LeaveRequest.end_date >= start_date,
+            LeaveRequest.status.in_(BOOKED_STATUSES),
+        )
+        .limit(1)
+    )
+    return overlap is not None
+
+
+def submit_leave_request(employee: Employee, start_date: date, end_date: date, reason: str) -> LeaveRequest:
+    """Create a pending request, queue the reviewer notification, and commit both together."""
+    leave_request = LeaveRequest(employee=employee, start_date=start_date, end_date=end_date, reason=reason)
+    db.session.add(leave_request)
+    db.session.flush()
+    jobs.enqueue("leave.notify_submitted", leave_request_id=leave_request.id)
+    db.session.commit()
+    return leave_request
+
+
+def decide_leave_requests(request_ids: Iterable[int], decision: str) -> Dict[int, str]:
+    """Approve or reject pending requests in one UPDATE and commit.
+
+    Returns the outcome for every requested id: the new status, ``"already_<status>"`` for
+    requests that were no longer pending, or ``"not_found"``.
+    """
+    new_status = DECISIONS[decision]
+    request_ids = list(dict.fromkeys(request_ids))
+    decided_ids = set()
+    decided_at = datetime.utcnow()
+    if request_ids:
+        decided_ids = set(
+            db.session.scalars(
+                update(LeaveRequest)
+                .where(LeaveRequest.id.in_(request_ids), LeaveRequest.status == "pending")
+                .values(status=new_status, decided_at=decided_at, version=LeaveRequest.version + 1)
+                .returning(LeaveRequest.id)
+                .execution_options(synchronize_session=False)
+            )
+        )
+    remaining = [request_id for request_id in request_ids if request_id not in decided_ids]
+    current = {}
+    if remaining:
+        current = dict(db.session.execute(select(LeaveRequest.id, LeaveRequest.status).where(LeaveRequest.id.in_(remaining))).all())
+
+    if decided_ids:
+        changes.mark(LeaveRequest, decided_ids)
+        for request_id in sorted(decided_ids):
+            audit.record(LeaveRequest, request_id, "update", {"status": ["pending", new_status], "decided_at": [None, decided_at]})
+        jobs.enqueue("leave.notify_decided", leave_request_ids=sorted(decided_ids))
+    db.session.commit()
+
+    outcomes = {}
+    for request_id in request_ids:
+        if request_id in decided_ids:
+            outcomes[request_id] = new_status
+        elif request_id in current:
+            outcomes[request_id] = f"already_{current[request_id]}"
+        else:
+            outcomes[request_id] = "not_found"
+    return outcomes
+
+
+def working_days(start_dates: Sequence[date], end_dates: Sequence[date]) -> np.ndarray:
+    """Count business days in each inclusive ``[start, end]`` range in one vectorised call."""
+    starts = np.array(start_dates, dtype="datetime64[D]")
+    ends = np.array(end_dates, dtype="datetime64[D]") + np.timedelta64(1, "D")
+    return np.busday_count(starts, ends, busdaycal=current_app.extensions["leave_calendar"])
+
+
+def compute_balances(year: int, employee_ids: Optional[Iterable[int]] = None) -> List[LeaveBalance]:
+    """Return each employee's leave balance for ``year``.
+
+    ``Employee.leave_days`` is the yearly allowance. Approved requests are charged by the
+    working days they cover within the year; pending requests are reported but not charged.
+    Two column-only SELECTs feed a single busday_count/bincount pass, however many employees
+    there are.
+    """
+    year_start, year_end = date(year, 1, 1), date(year, 12, 31)
+    employee_query = select(Employee.id, Employee.leave_days).order_by(Employee.id)
+    leave_query = select(
+        LeaveRequest.employee_id, LeaveRequest.start_date, LeaveRequest.end_date, LeaveRequest.status
+    ).where(
+        LeaveRequest.status.in_(BOOKED_STATUSES),
+        LeaveRequest.start_date <= year_end,
+        LeaveRequest.end_date >= year_start,
+    )
+    if employee_ids is not None:
+        employee_ids = list(employee_ids)
+        employee_query = employee_query.where(Employee.id.in_(employee_ids))
+        leave_query = leave_query.where(LeaveRequest.employee_id.in_(employee_ids))
+
+    employees = db.session.execute(employee_query).all()
+    if not employees:
+        return []
+    ids = np.array([row[0] for row in employees], dtype=np.int64)
+    entitlements = np.array([row[1] for row in employees], dtype=np.int64)
+
+    used = np.zeros(len(ids), dtype=np.int64)
+    pending = np.zeros(len(ids), dtype=np.int64)
+    leave_rows = db.session.execute(leave_query).all()
+    if leave_rows:
+        owners = np.searchsorted(ids, np.array([row[0] for row in leave_rows], dtype=np.int64))
+        days = working_days(
+            [max(row[1], year_start) for row in leave_rows], [min(row[2], year_end) for row in leave_rows]
+        )
+        approved = np.array([row[3] == "approved" for row in leave_rows])
+        used = np.bincount(owners[approved], weights=days[approved], minlength=len(ids)).astype(np.int64)
+        pending = np.bincount(owners[~approved], weights=days[~approved], minlength=len(ids)).astype(np.int64)
+
+    remaining = entitlements - used
+    return [
+        LeaveBalance(
+            employee_id=int(ids[index]),
+            year=year,
+            entitlement=int(entitlements[index]),
+            used=int(used[index]),
+            pending=int(pending[index]),
+            remaining=int(remaining[index]),
+        )
+        for index in range(len(ids))
+    ]
+
+
+@jobs.handler("leave.notify_submitted")
+def _notify_submitted(leave_request_id: int) -> None:
+    leave_request = db.session.get(LeaveRequest, leave_request_id)
+    if leave_request is None or leave_request.status != "pending":
+        return
+    notifications.info(
+        "Leave request %s from %s (%s to %s) is awaiting review.",
+        leave_request.id,
+        leave_request.employee.name,
+        leave_request.start_date.isoformat(),
+        leave_request.end_date.isoformat(),
+    )
+
+
+@jobs.handler("leave.notify_decided")
+def _notify_decided(leave_request_ids: List[int]) -> None:
+    rows = db.session.execute(
+        select(LeaveRequest.id, LeaveRequest.status, LeaveRequest.start_date, LeaveRequest.end_date, Employee.name)
+        .join(Employee, LeaveRequest.employee_id == Employee.id)
+        .where(LeaveRequest.id.in_(leave_request_ids))
+        .order_by(LeaveRequest.id)
+    )
+    for row in rows:
+        notifications.info(
+            "%s, your leave request %s (%s to %s) was %s.",
+            row.name,
+            row.id,
+            row.start_date.isoformat(),
+            row.end_date.isoformat(),
+            row.status,
+        )
@@ -0,0 +1,261 @@
+﻿import bisect
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+
+# Seconds. Request and query buckets follow the Prometheus client defaults, trimmed at the low end.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+KDF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# How often a worker sharing metrics through METRICS_DIR rewrites its file while serving requests.
+DUMP_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus exposition model."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            return [[list(labels), list(counts), total] for labels, (counts, total) in self._series.items()]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def collect(self, snapshots: Optional[Iterable[List[list]]] = None) -> Iterator[str]:
+        """Render this histogram, or the sum of ``snapshots`` taken from several processes."""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        merged: Dict[Tuple[str, ...], list] = {}
+        for snapshot in snapshots if snapshots is not None else [self.snapshot()]:
+            for labels, counts, total in snapshot:
+                series = merged.setdefault(tuple(labels), [[0] * len(counts), 0.0])
+                series[0] = [left + right for left, right in zip(series[0], counts)]
+                series[1] += total
+        for labels, (counts, total) in sorted(merged.items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="{bound}"}} {cumulative}'
+            suffix = f"{{{label_text}}}" if label_text else ""
+            yield f"{self.name}_sum{suffix} {total}"
+            yield f"{self.name}_count{suffix} {cumulative}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """The app's histograms.
+
+    With ``directory`` set, each process writes its own histograms to a file there, and
+    ``render`` sums the files. Every pre-forked server worker then reports the totals for
+    the whole server, so the series never jump between workers' private counts.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._pid: Optional[int] = None
+        self._path: Optional[str] = None
+        self._dumped_at = 0.0
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Request latency.", ("endpoint", "method", "status"), LATENCY_BUCKETS
+        )
+        self.request_queries = Histogram(
+            "http_request_db_queries", "SQL statements executed per request.", ("endpoint",), QUERY_COUNT_BUCKETS
+        )
+        self.query_duration = Histogram(
+            "db_query_duration_seconds", "SQL statement execution time.", ("endpoint",), LATENCY_BUCKETS
+        )
+        self.password_hash_duration = Histogram(
+            "password_hash_duration_seconds", "Time spent hashing or checking passwords.", ("operation",), KDF_BUCKETS
+        )
+
+    @property
+    def histograms(self) -> Tuple[Histogram, ...]:
+        return (self.request_duration, self.request_queries, self.query_duration, self.password_hash_duration)
+
+    def reset(self) -> None:
+        """Drop observations inherited from the parent process after a fork."""
+        for histogram in self.histograms:
+            histogram.reset()
+
+    def dump(self) -> None:
+        """Atomically write this process's histograms to its file in ``directory``."""
+        if self._pid != os.getpid():
+            # Start time as well as pid, so a recycled pid never overwrites a dead worker's totals.
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f"metrics-{self._pid}-{time.time_ns()}.json")
+        data = {histogram.name: histogram.snapshot() for histogram in self.histograms}
+        temporary = f"{self._path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(data, handle)
+        os.replace(temporary, self._path)
+        self._dumped_at = time.monotonic()
+
+    def maybe_dump(self) -> None:
+        if self.directory and time.monotonic() - self._dumped_at > DUMP_INTERVAL:
+            self.dump()
+
+    def render(self) -> str:
+        snapshots = None
+        if self.directory:
+            self.dump()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+                try:
+                    with open(path, encoding="utf-8") as handle:
+                        snapshots.append(json.load(handle))
+                except (OSError, ValueError):
+                    logger.warning("Skipping unreadable metrics file %s", path)
+        lines: List[str] = []
+        for histogram in self.histograms:
+            lines.extend(histogram.collect(None if snapshots is None else [data.get(histogram.name, []) for data in snapshots]))
+        return "\n".join(lines) + "\n"
+
+
+def share_between_processes(app) -> None:
+    """Point the registry at ``METRICS_DIR`` (or a fresh temporary directory) before forking workers.
+
+    Files left by a previous run are removed so a restarted server starts from zero, which
+    Prometheus treats as an ordinary counter reset.
+    """
+    registry = app.extensions.get("metrics")
+    if registry is None:
+        return
+    directory = app.config.get("METRICS_DIR") or tempfile.mkdtemp(prefix="metrics-")
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "metrics-*.json*")):
+        os.remove(path)
+    registry.directory = directory
+
+
+def after_fork(app) -> None:
+    registry = app.extensions.get("metrics")
+    if registry is not None:
+        registry.reset()
+
+
+def _registry():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("metrics")
+
+
+def _endpoint_label() -> str:
+    if not has_request_context():
+        return "background"
+    return request.endpoint or "unmatched"
+
+
+@contextmanager
+def time_password_hash(operation: str):
+    """Record how long a password hash/check takes, for /metrics and Server-Timing."""
+    registry = _registry()
+    if registry is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.password_hash_duration.observe(elapsed, operation)
+        if has_request_context() and "_metrics_started" in g:
+            g._metrics_kdf_time += elapsed
+
+
+def instrument_engine(engine, registry: MetricsRegistry) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["_metrics_query_start"].pop()
+        registry.query_duration.observe(elapsed, _endpoint_label())
+        if has_request_context() and "_metrics_started" in g:
+            g._metrics_query_count += 1
+            g._metrics_query_time += elapsed
+
+
+def init_app(app, db) -> None:
+    if not app.config["METRICS_ENABLED"]:
+        app.extensions["metrics"] = None
+        return
+
+    registry = app.extensions["metrics"] = MetricsRegistry(directory=app.config.get("METRICS_DIR"))
+    with app.app_context():
+        instrument_engine(db.engine, registry)
+    read_engine = app.extensions.get("read_engine")
+    if read_engine is not None:
+        instrument_engine(read_engine, registry)
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+        g._metrics_query_count = 0
+        g._metrics_query_time = 0.0
+        g._metrics_kdf_time = 0.0
+
+    @app.after_request
+    def _record(response):
+        if "_metrics_started" not in g:
+            return response
+        elapsed = time.perf_counter() - g._metrics_started
+        endpoint = _endpoint_label()
+        registry.request_duration.observe(elapsed, endpoint, request.method, str(response.status_code))
+        registry.request_queries.observe(g._metrics_query_count, endpoint)
+        if app.config["SERVER_TIMING_ENABLED"]:
+            timings = [
+                f'db;desc="{g._metrics_query_count} queries";dur={g._metrics_query_time * 1000:.2f}',
+                f"app;dur={elapsed * 1000:.2f}",
+            ]
+            if g._metrics_kdf_time:
+                timings.insert(1, f"kdf;dur={g._metrics_kdf_time * 1000:.2f}")
+            response.headers.add("Server-Timing", ", ".join(timings))
+        registry.maybe_dump()
+        return response
+
+    @app.get("/metrics")
+    def metrics():
+        token = app.config.get("METRICS_TOKEN")
+        if not token and app.config["DB_PROFILE"] == "production":
+            # Latency and endpoint names are not for the public internet; production needs a token.
+            return Response("Set METRICS_TOKEN to enable /metrics in production.\n", status=403, mimetype="text/plain")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
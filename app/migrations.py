@@ -0,0 +1,112 @@
+﻿from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import inspect, select, update
+
+from . import db
+from .models import AppMeta, Employee, LeaveRequest, User
+
+
+# Bump SCHEMA_VERSION and register a step with @migration(<new version>) whenever a model change
+# needs existing databases to be altered. Version 1 is the schema that predates versioning.
+# A version that only adds tables (4: table_version, 5: job, 6: audit_event, 7: rate_limit_bucket,
+# 8: token_revocation) needs no step: create_all() creates new tables, indexes and their DDL hooks.
+SCHEMA_VERSION = 10
+BASELINE_VERSION = 1
+SCHEMA_VERSION_KEY = "schema_version"
+
+MIGRATIONS: Dict[int, Callable] = {}
+
+
+def migration(version: int):
+    def decorator(func: Callable) -> Callable:
+        MIGRATIONS[version] = func
+        return func
+
+    return decorator
+
+
+def get_meta(key: str) -> Optional[str]:
+    return db.session.scalar(select(AppMeta.value).where(AppMeta.key == key))
+
+
+def set_meta(key: str, value: str) -> None:
+    db.session.merge(AppMeta(key=key, value=value))
+
+
+def upgrade_schema() -> int:
+    """Bring the database up to SCHEMA_VERSION and return the version it started from.
+
+    On an up-to-date database this costs a table check and a single SELECT, so it is safe
+    to run on every boot.
+    """
+    inspector = inspect(db.engine)
+    if inspector.has_table(AppMeta.__tablename__):
+        current = int(get_meta(SCHEMA_VERSION_KEY) or BASELINE_VERSION)
+    elif inspector.has_table(User.__tablename__):
+        current = BASELINE_VERSION
+    else:
+        current = 0
+
+    if current >= SCHEMA_VERSION:
+        return current
+
+    db.create_all()
+    if current:
+        with db.engine.begin() as connection:
+            for version in range(current + 1, SCHEMA_VERSION + 1):
+                step = MIGRATIONS.get(version)
+                if step is not None:
+                    step(connection)
+
+    set_meta(SCHEMA_VERSION_KEY, str(SCHEMA_VERSION))
+    db.session.commit()
+    return current
+
+
+def create_index(connection, table, name: str) -> None:
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(connection, checkfirst=True)
+
+
+def add_column(connection, table, name: str) -> None:
+    if any(column["name"] == name for column in inspect(connection).get_columns(table.name)):
+        return
+    column = table.c[name]
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(connection.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    connection.exec_driver_sql(ddl)
+
+
+@migration(2)
+def _add_user_role_index(connection) -> None:
+    create_index(connection, User.__table__, "ix_user_role_lower")
+
+
+@migration(3)
+def _add_leave_request_indexes(connection) -> None:
+    create_index(connection, LeaveRequest.__table__, "ix_leave_request_status_requested")
+    create_index(connection, LeaveRequest.__table__, "ix_leave_request_employee_requested")
+
+
+@migration(9)
+def _add_row_versions(connection) -> None:
+    add_column(connection, Employee.__table__, "version")
+    add_column(connection, LeaveRequest.__table__, "version")
+
+
+@migration(10)
+def _backfill_leave_requested_at(connection) -> None:
+    # Keyset pagination orders by requested_at, so legacy rows without one would break the
+    # cursor. Fall back to the decision time, then to the start of the leave. SQLite cannot add
+    # NOT NULL to an existing column, so only new databases enforce it in the schema.
+    table = LeaveRequest.__table__
+    rows = connection.execute(
+        select(table.c.id, table.c.decided_at, table.c.start_date).where(table.c.requested_at.is_(None))
+    ).all()
+    for row in rows:
+        requested_at = row.decided_at or datetime.combine(row.start_date, datetime.min.time())
+        connection.execute(update(table).where(table.c.id == row.id).values(requested_at=requested_at))
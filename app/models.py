@@ -1,9 +1,107 @@
-﻿from datetime import datetime
+﻿import json
+from datetime import datetime
 
 from flask_login import UserMixin
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from . import db
+from .metrics import time_password_hash
+
+
+class AppMeta(db.Model):
+    __tablename__ = "app_meta"
+
+    key = db.Column(db.String(120), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+
+
+class TableVersion(db.Model):
+    __tablename__ = "table_version"
+
+    name = db.Column(db.String(120), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class TokenRevocation(db.Model):
+    """A revoked JWT (``jti``) or a cut-off revoking every token a user was issued before it."""
+
+    __tablename__ = "token_revocation"
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    # Unix times, compared directly with the tokens' iat/exp claims.
+    revoked_at = db.Column(db.Float, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
+
+class RateLimitBucket(db.Model):
+    __tablename__ = "rate_limit_bucket"
+
+    key = db.Column(db.String(255), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    # Unix time of the last refill, so refills are plain arithmetic in SQL.
+    updated_at = db.Column(db.Float, nullable=False)
+
+
+class Job(db.Model):
+    __table_args__ = (
+        # Workers claim the oldest due jobs: WHERE status = ? AND run_at <= ? ORDER BY run_at.
+        db.Index("ix_job_status_run_at", "status", "run_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(20), default="queued", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class AuditEvent(db.Model):
+    """Append-only record of one change to an audited row."""
+
+    __tablename__ = "audit_event"
+    __table_args__ = (
+        # History of one record over a time range: WHERE entity = ? AND entity_id = ? AND ts BETWEEN ...
+        db.Index("ix_audit_event_entity_ts", "entity", "entity_id", "ts"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    ts = db.Column(db.DateTime, nullable=False)
+    entity = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)
+    actor_id = db.Column(db.Integer, nullable=True)
+    changes = db.Column(db.Text, nullable=False)
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "ts": self.ts.isoformat(),
+            "entity": self.entity,
+            "entity_id": self.entity_id,
+            "action": self.action,
+            "actor_id": self.actor_id,
+            "changes": json.loads(self.changes),
+        }
+
+
+# SQLite refuses UPDATE/DELETE on audit rows; the triggers are created with the table.
+for _operation in ("UPDATE", "DELETE"):
+    db.event.listen(
+        AuditEvent.__table__,
+        "after_create",
+        db.DDL(
+            f"CREATE TRIGGER audit_event_no_{_operation.lower()} BEFORE {_operation} ON audit_event "
+            "BEGIN SELECT RAISE(ABORT, 'audit_event is append-only'); END"
+        ).execute_if(dialect="sqlite"),
+    )
 
 
 class User(UserMixin, db.Model):
@@ -14,10 +112,16 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        with time_password_hash("set"):
+            self.password_hash = generate_password_hash(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        with time_password_hash("check"):
+            return check_password_hash(self.password_hash, password)
+
+
+# Expression index so the case-insensitive administrator count does not scan the table.
+db.Index("ix_user_role_lower", db.func.lower(User.role))
 
 
 class Employee(db.Model):
@@ -29,6 +133,10 @@ class Employee(db.Model):
     start_date = db.Column(db.Date, nullable=True)
     leave_days = db.Column(db.Integer, default=0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every UPDATE, which only matches the version that was loaded (optimistic locking).
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
     user = db.relationship("User", backref=db.backref("employee_profile", uselist=False))
     leave_requests = db.relationship(
@@ -46,18 +154,30 @@ class Employee(db.Model):
             "start_date": self.start_date.isoformat() if self.start_date else None,
             "leave_days": self.leave_days,
             "created_at": self.created_at.isoformat() if self.created_at else None,
+            "version": self.version,
         }
 
 
 class LeaveRequest(db.Model):
+    __table_args__ = (
+        # Approval queues: filter by status, newest first, keyset on (requested_at, id).
+        db.Index("ix_leave_request_status_requested", "status", "requested_at", "id"),
+        # Per-employee history on the profile page.
+        db.Index("ix_leave_request_employee_requested", "employee_id", "requested_at", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey("employee.id"), nullable=False)
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     reason = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), default="pending", nullable=False)
-    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # NOT NULL because it is the keyset pagination key; migration 10 backfills legacy rows.
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     decided_at = db.Column(db.DateTime, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
     def as_dict(self) -> dict:
         return {
@@ -69,4 +189,5 @@ class LeaveRequest(db.Model):
             "status": self.status,
             "requested_at": self.requested_at.isoformat() if self.requested_at else None,
             "decided_at": self.decided_at.isoformat() if self.decided_at else None,
+            "version": self.version,
         }
@@ -0,0 +1,33 @@
+﻿from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    return f"{timestamp.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Parse a cursor produced by ``encode_cursor``; raises ValueError when malformed."""
+    timestamp, _, row_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+
+def keyset_page_desc(query, timestamp_column, id_column, limit: int, cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """Return one page ordered newest first plus the cursor for the next page.
+
+    Seeks past ``cursor`` with a row-value comparison instead of OFFSET, so every page costs
+    the same index range scan however deep the caller pages.
+    """
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(timestamp_column, id_column) < tuple_(timestamp, row_id))
+
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
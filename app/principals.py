@@ -0,0 +1,167 @@
+﻿import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+
+from . import changes, db
+from .tokens import user_revoked_at
+from .models import User
+
+
+# Columns copied into the cache; enough to rebuild a User without touching the database.
+SNAPSHOT_COLUMNS = ("id", "username", "password_hash", "role", "created_at")
+# A change to any of these makes a cached principal unsafe to reuse.
+INVALIDATING_COLUMNS = ("username", "password_hash", "role")
+# Entries cached this soon after a revocation may have read the row before the revoking
+# transaction committed, so they are re-read once more.
+REVOCATION_GRACE_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: Optional[str]
+    role: Optional[str]
+
+
+class PrincipalCache:
+    """Thread-safe LRU of user snapshots whose entries expire after ``ttl`` seconds.
+
+    ``get`` also drops entries cached before ``stale_before``, which lets callers reject
+    snapshots that another worker's write has made obsolete.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, stale_before: Optional[float] = None) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, cached_at, snapshot = entry
+            if expires_at < time.monotonic() or (stale_before is not None and cached_at <= stale_before):
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return snapshot
+
+    def put(self, user_id: int, snapshot: dict) -> None:
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, time.time(), snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def init_app(app) -> None:
+    app.extensions["principal_cache"] = PrincipalCache(
+        maxsize=app.config["PRINCIPAL_CACHE_SIZE"],
+        ttl=app.config["PRINCIPAL_CACHE_TTL"],
+    )
+
+
+def _cache() -> Optional[PrincipalCache]:
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("principal_cache")
+
+
+def _snapshot(user_id: int) -> Optional[dict]:
+    cache = _cache()
+    snapshot = None
+    if cache is not None:
+        # Role and password changes and deletions revoke the user's tokens. The revocation list
+        # syncs across workers, so its cut-off also expires entries this worker cached earlier.
+        revoked_at = user_revoked_at(user_id)
+        snapshot = cache.get(user_id, None if revoked_at is None else revoked_at + REVOCATION_GRACE_SECONDS)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = {column: getattr(user, column) for column in SNAPSHOT_COLUMNS}
+        if cache is not None:
+            cache.put(user_id, snapshot)
+    return snapshot
+
+
+def get_principal(user_id: int) -> Optional[Principal]:
+    snapshot = _snapshot(user_id)
+    if snapshot is None:
+        return None
+    return Principal(id=snapshot["id"], username=snapshot["username"], role=snapshot["role"])
+
+
+def load_user(user_id: int) -> Optional[User]:
+    """Return a session-bound User, rebuilt from the cache when possible."""
+    snapshot = _snapshot(user_id)
+    if snapshot is None:
+        return None
+    user = db.session.identity_map.get(inspect(User).identity_key_from_primary_key((user_id,)))
+    if user is not None:
+        return user
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    # load=False attaches the rebuilt instance to the session without issuing a SELECT.
+    return db.session.merge(user, load=False)
+
+
+def invalidate(user_id: int) -> None:
+    cache = _cache()
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+@event.listens_for(User, "after_update")
+def _on_user_update(mapper, connection, target) -> None:
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in INVALIDATING_COLUMNS):
+        _invalidate_on_commit(target)
+
+
+@event.listens_for(User, "after_delete")
+def _on_user_delete(mapper, connection, target) -> None:
+    _invalidate_on_commit(target)
+
+
+def _invalidate_on_commit(user: User) -> None:
+    invalidate(user.id)
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault("invalidated_principals", set()).add(user.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session) -> None:
+    # Invalidate again once the change is visible so a concurrent reader cannot re-cache the old row.
+    user_ids = session.info.pop("invalidated_principals", ())
+
+    def apply() -> None:
+        for user_id in user_ids:
+            invalidate(user_id)
+
+    changes.when_committed(session, apply)
+
+
+@event.listens_for(Session, "after_rollback")
+def _on_rollback(session) -> None:
+    session.info.pop("invalidated_principals", None)
@@ -0,0 +1,107 @@
+﻿from datetime import date, datetime
+from typing import Optional
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+from . import db
+from .models import Employee
+from .stats import SnapshotCache
+from .versions import get_table_versions
+
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Upper bounds (in years) of each tenure band; anything beyond the last edge lands in the final band.
+TENURE_EDGES = (1, 3, 5, 10)
+TENURE_LABELS = ("<1y", "1-3y", "3-5y", "5-10y", "10y+")
+
+
+def init_app(app) -> None:
+    app.extensions["payroll_report"] = SnapshotCache(ttl=app.config["PAYROLL_REPORT_TTL"])
+
+
+def get_payroll_report() -> dict:
+    return current_app.extensions["payroll_report"].get_or_compute(build_payroll_report, get_table_versions(Employee))
+
+
+def build_payroll_report(today: Optional[date] = None) -> dict:
+    """Aggregate salaries overall, per role and per tenure band.
+
+    Only the three needed columns are selected (no ORM instances). They are turned into numpy
+    arrays once, and every group total, mean and percentile comes from array operations over
+    those columns.
+    """
+    today = today or date.today()
+    rows = db.session.execute(select(Employee.salary, Employee.role, Employee.start_date)).all()
+    report = {
+        "currency": "GHS",
+        "generated_at": datetime.utcnow().isoformat(),
+        "headcount": len(rows),
+        "total": 0.0,
+        "mean": None,
+        "percentiles": {},
+        "by_role": [],
+        "by_tenure": [],
+    }
+    if not rows:
+        return report
+
+    salaries = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+    roles, role_index = np.unique(np.array([row[1] for row in rows], dtype=object), return_inverse=True)
+    start_dates = np.array([row[2] for row in rows], dtype="datetime64[D]")
+
+    report["total"] = float(salaries.sum())
+    report["mean"] = float(salaries.mean())
+    report["percentiles"] = _named_percentiles(np.percentile(salaries, PERCENTILES))
+
+    counts, totals, percentiles = _grouped(salaries, role_index, len(roles))
+    report["by_role"] = [
+        {
+            "role": str(role),
+            "headcount": int(counts[index]),
+            "total": float(totals[index]),
+            "mean": float(totals[index] / counts[index]),
+            "percentiles": _named_percentiles(percentiles[:, index]),
+        }
+        for index, role in enumerate(roles)
+    ]
+
+    tenure_years = (np.datetime64(today, "D") - start_dates).astype("timedelta64[D]").astype(np.float64) / 365.25
+    known = ~np.isnat(start_dates)
+    band_index = np.where(known, np.digitize(tenure_years, TENURE_EDGES), len(TENURE_LABELS))
+    labels = TENURE_LABELS + ("unknown",)
+    counts, totals, _ = _grouped(salaries, band_index, len(labels))
+    report["by_tenure"] = [
+        {
+            "band": label,
+            "headcount": int(counts[index]),
+            "total": float(totals[index]),
+            "mean": float(totals[index] / counts[index]),
+        }
+        for index, label in enumerate(labels)
+        if counts[index]
+    ]
+    return report
+
+
+def _grouped(values: np.ndarray, groups: np.ndarray, group_count: int):
+    """Return per-group counts, sums and linear-interpolated percentiles without a Python loop."""
+    counts = np.bincount(groups, minlength=group_count)
+    totals = np.bincount(groups, weights=values, minlength=group_count)
+
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    fractions = np.array(PERCENTILES, dtype=np.float64)[:, None] / 100.0
+    positions = starts + fractions * np.maximum(counts - 1, 0)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    lower = np.minimum(lower, len(ordered) - 1)
+    upper = np.minimum(upper, len(ordered) - 1)
+    percentiles = ordered[lower] + (ordered[upper] - ordered[lower]) * (positions - lower)
+    return counts, totals, percentiles
+
+
+def _named_percentiles(values) -> dict:
+    return {f"p{percentile}": float(value) for percentile, value in zip(PERCENTILES, values)}
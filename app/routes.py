@@ -1,14 +1,34 @@
-﻿from datetime import datetime
+﻿from datetime import date, datetime
 
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask import Blueprint, abort, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.exc import StaleDataError
 
 from . import db
 from .models import Employee, LeaveRequest, User
+from .leave import (
+    DECISIONS,
+    LEAVE_STATUSES,
+    OVERLAP_MESSAGE,
+    compute_balances,
+    decide_leave_requests,
+    has_overlapping_leave,
+    parse_leave_period,
+    submit_leave_request,
+    working_days,
+)
+from .pagination import keyset_page_desc
+from .search import get_search_index
+from .stats import get_dashboard_stats
 
 
 main_bp = Blueprint("main", __name__)
 
+LEAVE_PAGE_SIZE = 20
+DASHBOARD_SEARCH_LIMIT = 50
+CONFLICT_MESSAGE = "Someone else updated this employee while you were editing. Review the current details and save again."
+
 
 def _current_user_is_admin() -> bool:
     return (current_user.role or "").lower() == "admin"
@@ -18,18 +38,33 @@ def _current_user_is_admin() -> bool:
 @login_required
 def dashboard():
     if _current_user_is_admin():
-        employees = Employee.query.order_by(Employee.id.asc()).all()
-        leave_requests = (
-            LeaveRequest.query.order_by(LeaveRequest.status.asc(), LeaveRequest.requested_at.desc()).all()
+        search_query = request.args.get("q", "").strip()
+        if search_query:
+            employee_ids = [result.employee_id for result in get_search_index().search(search_query, DASHBOARD_SEARCH_LIMIT)]
+            found = {
+                employee.id: employee
+                for employee in Employee.query.options(joinedload(Employee.user)).filter(Employee.id.in_(employee_ids))
+            }
+            employees = [found[employee_id] for employee_id in employee_ids if employee_id in found]
+        else:
+            employees = Employee.query.options(joinedload(Employee.user)).order_by(Employee.id.asc()).all()
+        queue_status = request.args.get("queue", "pending")
+        if queue_status not in LEAVE_STATUSES:
+            queue_status = "pending"
+        leave_requests, next_cursor = _leave_page(
+            LeaveRequest.query.options(joinedload(LeaveRequest.employee).joinedload(Employee.user)).filter(
+                LeaveRequest.status == queue_status
+            ),
+            request.args.get("after"),
         )
-        pending_count = sum(1 for req in leave_requests if req.status == "pending")
-        admin_count = User.query.filter(User.role.ilike("admin")).count()
         return render_template(
             "index.html",
             employees=employees,
-            admin_count=admin_count,
             leave_requests=leave_requests,
-            pending_count=pending_count,
+            queue_status=queue_status,
+            next_cursor=next_cursor,
+            stats=get_dashboard_stats(),
+            search_query=search_query,
         )
 
     employee = current_user.employee_profile
@@ -43,42 +78,46 @@ def dashboard():
         end_date_str = request.form.get("end_date", "").strip()
         reason = request.form.get("reason", "").strip()
 
-        error = None
-        start_date = end_date = None
-        if not start_date_str or not end_date_str:
-            error = "Start and end dates are required."
-        else:
-            try:
-                start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
-                end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
-                if end_date < start_date:
-                    raise ValueError
-            except ValueError:
-                error = "Please provide valid start and end dates (end date cannot be before start date)."
-
-        if error:
-            flash(error, "danger")
+        try:
+            start_date, end_date = parse_leave_period(start_date_str, end_date_str)
+            if has_overlapping_leave(employee.id, start_date, end_date):
+                raise ValueError(OVERLAP_MESSAGE)
+        except ValueError as exc:
+            flash(str(exc), "danger")
         else:
-            leave_request = LeaveRequest(
-                employee=employee,
-                start_date=start_date,
-                end_date=end_date,
-                reason=reason,
-            )
-            db.session.add(leave_request)
-            db.session.commit()
+            submit_leave_request(employee, start_date, end_date, reason)
             flash("Leave request submitted. We'll notify you once it's reviewed.", "success")
             return redirect(url_for("main.dashboard"))
 
-    leave_requests = []
+    leave_requests, next_cursor = [], None
+    balance, days_by_request = None, {}
     if employee:
-        leave_requests = (
-            LeaveRequest.query.filter_by(employee_id=employee.id)
-            .order_by(LeaveRequest.requested_at.desc())
-            .all()
+        leave_requests, next_cursor = _leave_page(
+            LeaveRequest.query.filter_by(employee_id=employee.id), request.args.get("after")
         )
+        balance = compute_balances(date.today().year, [employee.id])[0]
+        if leave_requests:
+            days = working_days([item.start_date for item in leave_requests], [item.end_date for item in leave_requests])
+            days_by_request = {item.id: int(count) for item, count in zip(leave_requests, days)}
+
+    return render_template(
+        "profile.html",
+        employee=employee,
+        leave_requests=leave_requests,
+        next_cursor=next_cursor,
+        balance=balance,
+        days_by_request=days_by_request,
+    )
 
-    return render_template("profile.html", employee=employee, leave_requests=leave_requests)
+
+def _leave_page(query, cursor):
+    try:
+        return keyset_page_desc(
+            query, LeaveRequest.requested_at, LeaveRequest.id, LEAVE_PAGE_SIZE, cursor
+        )
+    except ValueError:
+        # A stale or hand-edited cursor just restarts from the newest requests.
+        return keyset_page_desc(query, LeaveRequest.requested_at, LeaveRequest.id, LEAVE_PAGE_SIZE)
 
 
 @main_bp.route("/admin/manage", methods=["GET", "POST"])
@@ -96,7 +135,7 @@ def manage():
             _handle_employee_creation()
         return redirect(url_for("main.manage"))
 
-    users = User.query.order_by(User.username.asc()).all()
+    users = User.query.options(selectinload(User.employee_profile)).order_by(User.username.asc()).all()
     employees = Employee.query.order_by(Employee.id.asc()).all()
     available_users = User.query.filter(User.employee_profile == None).order_by(User.username.asc()).all()  # noqa: E711
     return render_template(
@@ -210,8 +249,12 @@ def edit_employee(employee_id: int):
         salary = request.form.get("salary", "").strip()
         start_date_str = request.form.get("start_date", "").strip()
         leave_days_str = request.form.get("leave_days", "").strip()
+        version_str = request.form.get("version", "").strip()
 
         error = None
+        if version_str and version_str != str(employee.version):
+            flash(CONFLICT_MESSAGE, "warning")
+            return render_template("edit.html", employee=employee), 409
         if not name or not role or not salary:
             error = "All fields are required."
 
@@ -246,7 +289,12 @@ def edit_employee(employee_id: int):
             employee.salary = salary_value
             employee.start_date = start_date
             employee.leave_days = leave_days
-            db.session.commit()
+            try:
+                db.session.commit()
+            except StaleDataError:
+                db.session.rollback()
+                flash(CONFLICT_MESSAGE, "warning")
+                return render_template("edit.html", employee=Employee.query.get_or_404(employee_id)), 409
             flash("Employee updated successfully.", "success")
             return redirect(url_for("main.dashboard"))
 
@@ -270,16 +318,51 @@ def delete_employee(employee_id: int):
 @main_bp.route("/leave-requests/<int:request_id>/approve", methods=["POST"])
 @login_required
 def approve_leave_request(request_id: int):
+    return _decide_single(request_id, "approve")
+
+
+@main_bp.route("/leave-requests/<int:request_id>/reject", methods=["POST"])
+@login_required
+def reject_leave_request(request_id: int):
+    return _decide_single(request_id, "reject")
+
+
+@main_bp.route("/leave-requests/decide", methods=["POST"])
+@login_required
+def decide_leave_requests_bulk():
+    if not _current_user_is_admin():
+        flash("Administrator privileges are required to review leave requests.", "danger")
+        return redirect(url_for("main.dashboard"))
+
+    decision = request.form.get("decision")
+    try:
+        request_ids = [int(value) for value in request.form.getlist("ids")]
+    except ValueError:
+        request_ids = []
+    if decision not in DECISIONS or not request_ids:
+        flash("Select at least one leave request and a decision.", "warning")
+        return redirect(url_for("main.dashboard"))
+
+    outcomes = decide_leave_requests(request_ids, decision)
+    decided = sum(1 for outcome in outcomes.values() if outcome == DECISIONS[decision])
+    skipped = len(outcomes) - decided
+    message = f"{decided} leave request(s) {DECISIONS[decision]}."
+    if skipped:
+        message += f" {skipped} skipped because they were already decided or no longer exist."
+    flash(message, "success" if decided else "info")
+    return redirect(url_for("main.dashboard"))
+
+
+def _decide_single(request_id: int, decision: str):
     if not _current_user_is_admin():
-        flash("Administrator privileges are required to approve leave requests.", "danger")
+        flash("Administrator privileges are required to review leave requests.", "danger")
         return redirect(url_for("main.dashboard"))
 
-    leave_request = LeaveRequest.query.get_or_404(request_id)
-    if leave_request.status == "approved":
-        flash("This leave request has already been approved.", "info")
+    outcome = decide_leave_requests([request_id], decision)[request_id]
+    if outcome == "not_found":
+        abort(404)
+    if outcome.startswith("already_"):
+        flash(f"This leave request has already been {outcome[len('already_'):]}.", "info")
     else:
-        leave_request.status = "approved"
-        leave_request.decided_at = datetime.utcnow()
-        db.session.commit()
-        flash("Leave request approved.", "success")
+        flash(f"Leave request {outcome}.", "success")
     return redirect(url_for("main.dashboard"))
@@ -0,0 +1,219 @@
+﻿import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+from flask import current_app
+from sqlalchemy import or_, select
+
+from . import changes, db
+from .models import Employee, User
+
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+# Minimum trigram Jaccard similarity for a misspelt term to count as a match.
+MIN_SIMILARITY = 0.3
+EXACT_SCORE, PREFIX_SCORE, FUZZY_WEIGHT = 1.0, 0.8, 0.7
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    employee_id: int
+    name: str
+    role: str
+    username: Optional[str]
+    score: float
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.employee_id,
+            "name": self.name,
+            "role": self.role,
+            "username": self.username,
+            "score": round(self.score, 3),
+        }
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_PATTERN.findall((text or "").casefold())
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class EmployeeSearchIndex:
+    """In-memory prefix and trigram index over employee name, role and username.
+
+    Terms live in a sorted list for prefix lookups and in a trigram posting map for typo
+    tolerance, so a query touches only the terms that share a prefix or rare trigram with it.
+    Like the leave index it loads with one query on first use, re-reads only rows touched by
+    local commits, and fully reloads after ``ttl`` seconds to pick up other workers' writes.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._stale_employee_ids: Set[int] = set()
+        self._stale_user_ids: Set[int] = set()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._documents: Dict[int, tuple] = {}
+        self._terms_by_employee: Dict[int, Set[str]] = {}
+        self._employees_by_term: Dict[str, Set[int]] = {}
+        self._sorted_terms: List[str] = []
+        self._terms_by_trigram: Dict[str, Set[str]] = {}
+        self._trigrams_by_term: Dict[str, Set[str]] = {}
+
+    def invalidate(self, employee_ids: Optional[Iterable[int]] = None, user_ids: Optional[Iterable[int]] = None) -> None:
+        with self._lock:
+            if employee_ids is None and user_ids is None:
+                self._loaded_at = None
+                return
+            self._stale_employee_ids.update(employee_ids or ())
+            self._stale_user_ids.update(user_ids or ())
+
+    def search(self, query: str, limit: int = 20) -> List[SearchResult]:
+        """Rank employees matching every term of ``query`` exactly, by prefix, or approximately."""
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return []
+        with self._lock:
+            self._refresh()
+            scores: Optional[Dict[int, float]] = None
+            for query_term in query_terms:
+                term_scores = self._match(query_term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {employee_id: score + term_scores[employee_id] for employee_id, score in scores.items() if employee_id in term_scores}
+                if not scores:
+                    return []
+            ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], self._documents[item[0]][0].casefold(), item[0]))
+            return [SearchResult(employee_id, *self._documents[employee_id], score) for employee_id, score in ranked]
+
+    def _match(self, query_term: str) -> Dict[int, float]:
+        """Best score per employee for one query term."""
+        term_scores: Dict[str, float] = {}
+        start = bisect.bisect_left(self._sorted_terms, query_term)
+        for term in self._sorted_terms[start:]:
+            if not term.startswith(query_term):
+                break
+            term_scores[term] = EXACT_SCORE if term == query_term else PREFIX_SCORE
+
+        if not term_scores:
+            # Fall back to typo tolerance only when nothing matches exactly or by prefix.
+            term_scores = self._similar_terms(query_term)
+
+        best: Dict[int, float] = {}
+        for term, score in term_scores.items():
+            for employee_id in self._employees_by_term[term]:
+                if score > best.get(employee_id, 0.0):
+                    best[employee_id] = score
+        return best
+
+    def _similar_terms(self, query_term: str) -> Dict[str, float]:
+        """Terms whose trigram Jaccard similarity with ``query_term`` is at least MIN_SIMILARITY.
+
+        A match must share at least ``ceil(MIN_SIMILARITY * len(query_grams))`` trigrams, so
+        it contains one of the rarest ``len(query_grams) - that + 1`` of them; only those
+        posting lists are scanned for candidates.
+        """
+        query_grams = trigrams(query_term)
+        required = math.ceil(MIN_SIMILARITY * len(query_grams))
+        rarest = sorted(query_grams, key=lambda gram: len(self._terms_by_trigram.get(gram, ())))
+        candidates = set()
+        for gram in rarest[: len(query_grams) - required + 1]:
+            candidates.update(self._terms_by_trigram.get(gram, ()))
+
+        scores = {}
+        for term in candidates:
+            term_grams = self._trigrams_by_term[term]
+            shared = len(query_grams & term_grams)
+            similarity = shared / (len(query_grams) + len(term_grams) - shared)
+            if similarity >= MIN_SIMILARITY:
+                scores[term] = similarity * FUZZY_WEIGHT
+        return scores
+
+    def _refresh(self) -> None:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._reset()
+            self._stale_employee_ids.clear()
+            self._stale_user_ids.clear()
+            for row in db.session.execute(_document_query()):
+                self._add(*row)
+            self._loaded_at = time.monotonic()
+            return
+
+        if self._stale_employee_ids or self._stale_user_ids:
+            employee_ids, self._stale_employee_ids = self._stale_employee_ids, set()
+            user_ids, self._stale_user_ids = self._stale_user_ids, set()
+            for employee_id in employee_ids:
+                self._remove(employee_id)
+            query = _document_query().where(or_(Employee.id.in_(employee_ids), Employee.user_id.in_(user_ids)))
+            for row in db.session.execute(query):
+                self._remove(row.id)
+                self._add(*row)
+
+    def _add(self, employee_id: int, name: str, role: str, username: Optional[str]) -> None:
+        self._documents[employee_id] = (name, role, username)
+        terms = set(tokenize(name)) | set(tokenize(role)) | set(tokenize(username))
+        if username:
+            terms.add(username.casefold())
+        self._terms_by_employee[employee_id] = terms
+        for term in terms:
+            employees = self._employees_by_term.get(term)
+            if employees is None:
+                employees = self._employees_by_term[term] = set()
+                bisect.insort(self._sorted_terms, term)
+                grams = self._trigrams_by_term[term] = trigrams(term)
+                for gram in grams:
+                    self._terms_by_trigram.setdefault(gram, set()).add(term)
+            employees.add(employee_id)
+
+    def _remove(self, employee_id: int) -> None:
+        self._documents.pop(employee_id, None)
+        for term in self._terms_by_employee.pop(employee_id, ()):
+            employees = self._employees_by_term[term]
+            employees.discard(employee_id)
+            if employees:
+                continue
+            del self._employees_by_term[term]
+            del self._sorted_terms[bisect.bisect_left(self._sorted_terms, term)]
+            for gram in self._trigrams_by_term.pop(term):
+                terms = self._terms_by_trigram[gram]
+                terms.discard(term)
+                if not terms:
+                    del self._terms_by_trigram[gram]
+
+
+def _document_query():
+    return select(Employee.id, Employee.name, Employee.role, User.username).outerjoin(User, Employee.user_id == User.id)
+
+
+def init_app(app) -> None:
+    app.extensions["employee_search"] = EmployeeSearchIndex(ttl=app.config["EMPLOYEE_SEARCH_TTL"])
+
+
+def get_search_index() -> EmployeeSearchIndex:
+    return current_app.extensions["employee_search"]
+
+
+@changes.on_commit(Employee, User)
+def _mark_stale(changed) -> None:
+    index = current_app.extensions.get("employee_search")
+    if index is None:
+        return
+    # Unit-of-work writes, inserts included, arrive with their ids and are re-indexed one by one.
+    # ``None`` only comes from bulk Core statements that did not report ids, so reload everything.
+    if changed.get(Employee, ()) is None or changed.get(User, ()) is None:
+        index.invalidate()
+    else:
+        index.invalidate(changed.get(Employee, ()), changed.get(User, ()))
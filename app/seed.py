@@ -1,7 +1,13 @@
-﻿from datetime import date
+﻿import hashlib
+import json
+from datetime import date
 
 from . import db
-from .models import Employee, User
+from .migrations import set_meta
+from .models import AppMeta, Employee, User
+
+
+SEED_KEY_PREFIX = "seed:"
 
 
 def seed_defaults() -> None:
@@ -68,8 +74,18 @@ def seed_defaults() -> None:
         },
     ]
 
+    usernames = [entry["username"] for entry in default_entries]
+    users = {user.username: user for user in User.query.filter(User.username.in_(usernames))}
+    fingerprints = {meta.key: meta.value for meta in AppMeta.query.filter(AppMeta.key.like(SEED_KEY_PREFIX + "%"))}
+
     for entry in default_entries:
-        user = User.query.filter_by(username=entry["username"]).first()
+        # Hashing passwords is deliberately slow, so entries that were already applied are skipped.
+        fingerprint = _fingerprint(entry)
+        seed_key = SEED_KEY_PREFIX + entry["username"]
+        user = users.get(entry["username"])
+        if user and fingerprints.get(seed_key) == fingerprint:
+            continue
+
         if not user:
             user = User(username=entry["username"], role=entry["role"])
             db.session.add(user)
@@ -79,18 +95,22 @@ def seed_defaults() -> None:
         db.session.flush()
 
         employee_data = entry.get("employee")
-        if not employee_data:
-            continue
+        if employee_data:
+            employee = Employee.query.filter_by(user_id=user.id).first()
+            if not employee:
+                employee = Employee(user=user)
+                db.session.add(employee)
+
+            employee.name = employee_data["name"]
+            employee.role = employee_data["role"]
+            employee.salary = employee_data["salary"]
+            employee.start_date = employee_data["start_date"]
+            employee.leave_days = employee_data["leave_days"]
+
+        set_meta(seed_key, fingerprint)
 
-        employee = Employee.query.filter_by(user_id=user.id).first()
-        if not employee:
-            employee = Employee(user=user)
-            db.session.add(employee)
+    db.session.commit()
 
-        employee.name = employee_data["name"]
-        employee.role = employee_data["role"]
-        employee.salary = employee_data["salary"]
-        employee.start_date = employee_data["start_date"]
-        employee.leave_days = employee_data["leave_days"]
 
-    db.session.commit()
+def _fingerprint(entry: dict) -> str:
+    return hashlib.sha256(json.dumps(entry, sort_keys=True, default=str).encode("utf-8")).hexdigest()
@@ -0,0 +1,102 @@
+﻿from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from .models import Employee, LeaveRequest
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+@dataclass(frozen=True)
+class Field:
+    column: Any = None
+    format: Optional[Callable[[Any], Any]] = None
+    constant: Any = None
+
+
+class Projection:
+    """Column-level view of a model for list endpoints.
+
+    Selecting only the requested columns returns plain row tuples (no ORM instances or
+    identity map), and ``serializer`` turns each tuple into a dict using a plan built once per
+    request rather than per row.
+    """
+
+    def __init__(self, fields: Dict[str, Field]):
+        self.fields = fields
+
+    def parse(self, fields_param: Optional[str]) -> List[str]:
+        """Return the requested field names in declaration order; raises ValueError on unknown names."""
+        if not fields_param:
+            return list(self.fields)
+        requested = {name.strip() for name in fields_param.split(",") if name.strip()}
+        unknown = requested - set(self.fields)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+        if not requested:
+            raise ValueError("fields cannot be empty.")
+        return [name for name in self.fields if name in requested]
+
+    def columns(self, names: Iterable[str], required: Iterable[Any] = ()) -> List[Any]:
+        columns = {column.key: column for column in required}
+        for name in names:
+            column = self.fields[name].column
+            if column is not None:
+                columns.setdefault(column.key, column)
+        return list(columns.values())
+
+    def serializer(self, names: Iterable[str], columns: List[Any]) -> Callable[[Any], dict]:
+        positions = {column.key: index for index, column in enumerate(columns)}
+        plan = []
+        for name in names:
+            field = self.fields[name]
+            index = positions[field.column.key] if field.column is not None else None
+            plan.append((name, index, field.format, field.constant))
+
+        def serialize(row) -> dict:
+            item = {}
+            for name, index, format_value, constant in plan:
+                if index is None:
+                    item[name] = constant
+                elif format_value is None:
+                    item[name] = row[index]
+                else:
+                    item[name] = format_value(row[index])
+            return item
+
+        return serialize
+
+    def serialize_all(self, rows: Iterable, names: List[str], columns: List[Any]) -> Iterator[dict]:
+        serialize = self.serializer(names, columns)
+        return (serialize(row) for row in rows)
+
+
+EMPLOYEE_PROJECTION = Projection(
+    {
+        "id": Field(Employee.id),
+        "user_id": Field(Employee.user_id),
+        "name": Field(Employee.name),
+        "role": Field(Employee.role),
+        "salary": Field(Employee.salary),
+        "salary_currency": Field(constant="GHS"),
+        "start_date": Field(Employee.start_date, _isoformat),
+        "leave_days": Field(Employee.leave_days),
+        "created_at": Field(Employee.created_at, _isoformat),
+        "version": Field(Employee.version),
+    }
+)
+
+LEAVE_REQUEST_PROJECTION = Projection(
+    {
+        "id": Field(LeaveRequest.id),
+        "employee_id": Field(LeaveRequest.employee_id),
+        "start_date": Field(LeaveRequest.start_date, _isoformat),
+        "end_date": Field(LeaveRequest.end_date, _isoformat),
+        "reason": Field(LeaveRequest.reason),
+        "status": Field(LeaveRequest.status),
+        "requested_at": Field(LeaveRequest.requested_at, _isoformat),
+        "decided_at": Field(LeaveRequest.decided_at, _isoformat),
+        "version": Field(LeaveRequest.version),
+    }
+)
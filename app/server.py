@@ -0,0 +1,101 @@
+﻿import multiprocessing
+import os
+
+import click
+from flask import current_app
+
+
+def default_workers() -> int:
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def build_options(bind, workers, threads, keepalive, timeout, graceful_timeout, max_requests) -> dict:
+    """Gunicorn settings for ``flask serve``; threaded workers use ``gthread``."""
+    return {
+        "bind": bind,
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread" if threads > 1 else "sync",
+        "keepalive": keepalive,
+        "timeout": timeout,
+        "graceful_timeout": graceful_timeout,
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests // 10 if max_requests else 0,
+        "preload_app": True,
+        "accesslog": "-",
+        "errorlog": "-",
+        "pre_fork": _pre_fork,
+        "post_fork": _post_fork,
+    }
+
+
+def _pre_fork(server, worker) -> None:
+    # Write audit events buffered in the master (e.g. by seeding) before the fork. Children drop
+    # the copies they inherit, so anything left here would only be written when the master exits.
+    from .audit import flush
+
+    with worker.app.callable.app_context():
+        flush()
+
+
+def _post_fork(server, worker) -> None:
+    # Connections opened by the master during migrations/seeding must not be shared with
+    # the forked workers; drop them so each worker opens its own pool.
+    application = worker.app.callable
+    from . import db
+
+    with application.app_context():
+        db.engine.dispose(close=False)
+    read_engine = application.extensions.get("read_engine")
+    if read_engine is not None:
+        read_engine.dispose(close=False)
+
+    # Metrics observed by the master (migrations, seeding) would otherwise be counted once per worker.
+    from .jobs import start_worker
+    from .metrics import after_fork
+
+    after_fork(application)
+    # Threads do not survive fork, so each worker starts its own job pool once its engine is fresh.
+    start_worker(application)
+
+
+def run(application, options: dict) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError as exc:  # pragma: no cover - gunicorn is not available on Windows
+        raise click.ClickException("flask serve requires gunicorn (pip install gunicorn)") from exc
+
+    class _Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    _Server().run()
+
+
+def init_app(app) -> None:
+    @app.cli.command("serve")
+    @click.option("--bind", "-b", envvar="SERVE_BIND", default="0.0.0.0:5000", show_default=True)
+    @click.option("--workers", "-w", envvar="SERVE_WORKERS", type=int, default=default_workers, show_default="2 x CPUs + 1")
+    @click.option("--threads", envvar="SERVE_THREADS", type=int, default=4, show_default=True)
+    @click.option("--keepalive", envvar="SERVE_KEEPALIVE", type=int, default=5, show_default=True, help="Seconds to hold idle keep-alive connections.")
+    @click.option("--timeout", envvar="SERVE_TIMEOUT", type=int, default=30, show_default=True)
+    @click.option("--graceful-timeout", envvar="SERVE_GRACEFUL_TIMEOUT", type=int, default=30, show_default=True)
+    @click.option("--max-requests", envvar="SERVE_MAX_REQUESTS", type=int, default=0, show_default=True, help="Recycle workers after this many requests (0 disables).")
+    def serve(bind, workers, threads, keepalive, timeout, graceful_timeout, max_requests):
+        """Serve the app with a pre-forking gunicorn server.
+
+        The app (and so its migrations and seeding) is loaded once in the master before the
+        workers fork. SIGTERM stops gracefully. SIGHUP re-forks workers from the preloaded
+        app, so new code only takes effect after a full restart.
+        """
+        options = build_options(bind, workers, threads, keepalive, timeout, graceful_timeout, max_requests)
+        # Workers share /metrics through files so any worker can answer a scrape with server totals.
+        from .metrics import share_between_processes
+
+        share_between_processes(current_app)
+        click.echo(f"Serving on {bind} with {workers} workers x {threads} threads (pid {os.getpid()})")
+        run(current_app._get_current_object(), options)
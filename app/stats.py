@@ -0,0 +1,82 @@
+﻿import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Hashable
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import db
+from .models import Employee, LeaveRequest, User
+from .versions import get_table_versions
+
+
+@dataclass(frozen=True)
+class DashboardStats:
+    headcount: int
+    pending_leave: int
+    admin_count: int
+    payroll_total: float
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class SnapshotCache:
+    """A single cached value that expires after ``ttl`` seconds or when its ``key`` changes.
+
+    Callers pass the table versions the value was computed from as ``key``. Writes from any
+    worker bump those versions, so every worker recomputes on its next read.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.value = None
+        self.key = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.value = None
+
+    def get_or_compute(self, compute: Callable[[], Any], key: Hashable = None) -> Any:
+        with self.lock:
+            if self.value is not None and self.key == key and self.expires_at > time.monotonic():
+                return self.value
+
+        # ``key`` was read before computing, so a write that races with ``compute`` leaves the
+        # stored key behind the table versions and the next read recomputes.
+        value = compute()
+        with self.lock:
+            self.value = value
+            self.key = key
+            self.expires_at = time.monotonic() + self.ttl
+        return value
+
+
+def init_app(app) -> None:
+    app.extensions["dashboard_stats"] = SnapshotCache(ttl=app.config["DASHBOARD_STATS_TTL"])
+
+
+def get_dashboard_stats() -> DashboardStats:
+    key = get_table_versions(Employee, LeaveRequest, User)
+    return current_app.extensions["dashboard_stats"].get_or_compute(_compute_stats, key)
+
+
+def _compute_stats() -> DashboardStats:
+    # One round trip: every tile is a scalar subquery answered from an index or a single scan.
+    row = db.session.execute(
+        select(
+            select(func.count(Employee.id)).scalar_subquery(),
+            select(func.count(LeaveRequest.id)).where(LeaveRequest.status == "pending").scalar_subquery(),
+            select(func.count(User.id)).where(func.lower(User.role) == "admin").scalar_subquery(),
+            select(func.coalesce(func.sum(Employee.salary), 0.0)).scalar_subquery(),
+        )
+    ).one()
+    return DashboardStats(
+        headcount=row[0],
+        pending_leave=row[1],
+        admin_count=row[2],
+        payroll_total=float(row[3]),
+    )
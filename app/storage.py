@@ -0,0 +1,109 @@
+﻿from flask import current_app, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+
+
+READ_ONLY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class RoutingSession(Session):
+    """Session that sends SELECTs from read-only requests to the read engine when one is configured.
+
+    Flushes and explicit ``session.connection()`` calls always use the primary engine, so a
+    read-only request that does end up writing still writes to the primary database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.bind is not None:
+            # Bound to an outer connection (the batch API): everything joins its transaction.
+            return self.bind
+        if (
+            bind is None
+            and self.info.get("read_only")
+            and isinstance(clause, Select)
+            and not self._flushing
+            and has_app_context()
+        ):
+            engine = current_app.extensions.get("read_engine")
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def configure(app) -> None:
+    """Fill in engine options for the ``production`` profile; call before ``db.init_app``."""
+    if app.config["DB_PROFILE"] != "production":
+        return
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    if _is_memory_sqlite(app.config["SQLALCHEMY_DATABASE_URI"]):
+        return
+    options.setdefault("pool_size", app.config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", app.config["DB_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", app.config["DB_POOL_TIMEOUT"])
+    options.setdefault("pool_pre_ping", True)
+    if _is_sqlite(app.config["SQLALCHEMY_DATABASE_URI"]):
+        connect_args = options.setdefault("connect_args", {})
+        connect_args.setdefault("timeout", app.config["SQLITE_BUSY_TIMEOUT_MS"] / 1000)
+        connect_args.setdefault("check_same_thread", False)
+
+
+def init_app(app, db) -> None:
+    """Apply SQLite pragmas and create the read engine; call after ``db.init_app``."""
+    if app.config["DB_PROFILE"] != "production":
+        return
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == "sqlite" and not _is_memory_sqlite(str(engine.url)):
+        _install_pragmas(engine, app.config)
+
+    if not app.config["DB_READ_SPLIT"]:
+        return
+    read_uri = app.config.get("SQLALCHEMY_READ_DATABASE_URI")
+    if read_uri is None and engine.dialect.name == "sqlite" and not _is_memory_sqlite(str(engine.url)):
+        # Same file, separate pool: WAL lets these readers run alongside the writer.
+        read_uri = engine.url
+    if read_uri is None:
+        return
+
+    read_engine = create_engine(read_uri, **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if read_engine.dialect.name == "sqlite":
+        _install_pragmas(read_engine, app.config, read_only=True)
+    app.extensions["read_engine"] = read_engine
+
+    @app.before_request
+    def _route_reads():
+        if request.method in READ_ONLY_METHODS:
+            db.session.info["read_only"] = True
+
+
+def _install_pragmas(engine, config, read_only: bool = False) -> None:
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def _is_sqlite(uri) -> bool:
+    return make_url(uri).get_backend_name() == "sqlite"
+
+
+def _is_memory_sqlite(uri) -> bool:
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
@@ -0,0 +1,117 @@
+﻿import threading
+import time
+from collections import OrderedDict
+from importlib import import_module
+from typing import Optional, Tuple
+
+from flask import current_app, request
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import RateLimitBucket
+
+
+class MemoryBackend:
+    """Per-process token buckets in a bounded LRU; enough for a single server process."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def consume(self, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        """Take one token from ``key``'s bucket; returns 0 if allowed, else seconds until one is free."""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / refill_per_second
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class DatabaseBackend:
+    """Token buckets in the ``rate_limit_bucket`` table, shared by every worker on the database.
+
+    Each attempt is one conditional UPDATE in its own short transaction, so concurrent
+    workers can never both spend the last token.
+    """
+
+    def consume(self, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        table = RateLimitBucket.__table__
+        refilled = table.c.tokens + (now - table.c.updated_at) * refill_per_second
+        available = case((refilled > capacity, capacity), else_=refilled)
+        with db.engine.begin() as connection:
+            spent = connection.execute(
+                update(table)
+                .where(table.c.key == key, available >= 1)
+                .values(tokens=available - 1, updated_at=now)
+            ).rowcount
+            if spent:
+                return 0.0
+            tokens = connection.scalar(select(available).where(table.c.key == key))
+        if tokens is None:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(table).values(key=key, tokens=capacity - 1, updated_at=now))
+                return 0.0
+            except IntegrityError:
+                # Another worker created the bucket first; charge this attempt against it.
+                return self.consume(key, capacity, refill_per_second, now)
+        return (1 - tokens) / refill_per_second
+
+
+BACKENDS = {"memory": MemoryBackend, "database": DatabaseBackend}
+
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """Parse ``"<attempts>/<seconds>"`` into bucket capacity and refill rate per second."""
+    try:
+        attempts, seconds = (float(part) for part in rate.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid rate {rate!r}; expected '<attempts>/<seconds>'.") from None
+    if attempts < 1 or seconds <= 0:
+        raise ValueError(f"Invalid rate {rate!r}; attempts must be >= 1 and seconds > 0.")
+    return int(attempts), attempts / seconds
+
+
+def _load_backend(name: str):
+    if name in BACKENDS:
+        return BACKENDS[name]()
+    # Anything else is "package.module:factory", e.g. a Redis-backed implementation.
+    module_name, _, attribute = name.partition(":")
+    return getattr(import_module(module_name), attribute)()
+
+
+def init_app(app) -> None:
+    app.extensions["login_throttle"] = {
+        "backend": _load_backend(app.config["LOGIN_THROTTLE_BACKEND"]),
+        "ip": parse_rate(app.config["LOGIN_RATE_LIMIT_IP"]),
+        "username": parse_rate(app.config["LOGIN_RATE_LIMIT_USERNAME"]),
+    }
+
+
+def check_login_attempt(username: str) -> Optional[int]:
+    """Charge a login attempt to the client IP and the username.
+
+    Returns ``None`` when the attempt may proceed, or the whole seconds to wait. Call this
+    before looking the user up so throttled attempts cost no database or hashing work.
+    """
+    if not current_app.config["LOGIN_THROTTLE_ENABLED"]:
+        return None
+    throttle = current_app.extensions["login_throttle"]
+    backend, now = throttle["backend"], time.time()
+    buckets = [("ip", f"login:ip:{request.remote_addr or 'unknown'}")]
+    if username:
+        buckets.append(("username", f"login:user:{username.casefold()}"))
+    wait = 0.0
+    for kind, key in buckets:
+        capacity, refill = throttle[kind]
+        wait = max(wait, backend.consume(key, capacity, refill, now))
+    return max(1, int(wait + 0.999)) if wait else None
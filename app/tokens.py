@@ -0,0 +1,190 @@
+﻿import threading
+import time
+from typing import Dict, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, insert, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+from . import changes, db, jwt
+from .models import TokenRevocation, User
+
+
+# Changing either of these ends every session the user already has.
+REVOKING_COLUMNS = ("role", "password_hash")
+
+_PENDING_KEY = "pending_token_revocations"
+
+
+class RevocationList:
+    """In-memory copy of ``token_revocation``: revoked token ids plus per-user cut-off times.
+
+    ``is_revoked`` is a set/dict lookup. ``load`` reads every unexpired entry at startup;
+    after that, rows written by other workers are picked up with one ``id > last seen`` query at
+    most every ``sync_interval`` seconds. Entries are dropped once every token they could
+    match has expired, so the set stays as small as the number of live revoked tokens.
+    """
+
+    def __init__(self, sync_interval: float):
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._jtis: Dict[str, float] = {}
+        self._user_cutoffs: Dict[int, tuple] = {}
+        self._last_id = 0
+        self._synced_at: Optional[float] = None
+
+    def is_revoked(self, payload: dict) -> bool:
+        with self._lock:
+            self._sync_if_due()
+            if payload.get("jti") in self._jtis:
+                return True
+            cutoff = self._user_cutoffs.get(_user_id(payload))
+            return cutoff is not None and _issued_at(payload) <= cutoff[0]
+
+    def user_cutoff(self, user_id: int) -> Optional[float]:
+        """Return when ``user_id``'s tokens were last revoked (a role, password or account change)."""
+        with self._lock:
+            self._sync_if_due()
+            cutoff = self._user_cutoffs.get(user_id)
+            return cutoff[0] if cutoff is not None else None
+
+    def load(self) -> None:
+        with self._lock:
+            self._sync()
+
+    def add(self, jti: Optional[str], user_id: Optional[int], revoked_at: float, expires_at: float) -> None:
+        with self._lock:
+            self._add(jti, user_id, revoked_at, expires_at)
+
+    def _sync_if_due(self) -> None:
+        if self._synced_at is None or time.monotonic() - self._synced_at > self.sync_interval:
+            self._sync()
+
+    def _add(self, jti, user_id, revoked_at, expires_at) -> None:
+        if jti is not None:
+            self._jtis[jti] = expires_at
+        if user_id is not None:
+            current = self._user_cutoffs.get(user_id)
+            if current is None or revoked_at > current[0]:
+                self._user_cutoffs[user_id] = (revoked_at, expires_at)
+
+    def _sync(self) -> None:
+        now = time.time()
+        rows = db.session.execute(
+            select(TokenRevocation.id, TokenRevocation.jti, TokenRevocation.user_id, TokenRevocation.revoked_at, TokenRevocation.expires_at)
+            .where(TokenRevocation.id > self._last_id, TokenRevocation.expires_at > now)
+            .order_by(TokenRevocation.id)
+        ).all()
+        for row in rows:
+            self._add(row.jti, row.user_id, row.revoked_at, row.expires_at)
+            self._last_id = row.id
+        self._jtis = {jti: expires for jti, expires in self._jtis.items() if expires > now}
+        self._user_cutoffs = {user_id: entry for user_id, entry in self._user_cutoffs.items() if entry[1] > now}
+        self._synced_at = time.monotonic()
+
+
+def _issued_at(payload: dict) -> float:
+    # ``iat`` has whole-second precision, too coarse for a login right after a password reset.
+    if "iat_ms" in payload:
+        return payload["iat_ms"] / 1000
+    return payload.get("iat", 0)
+
+
+def _user_id(payload: dict) -> Optional[int]:
+    try:
+        return int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+
+
+def init_app(app) -> None:
+    app.extensions["token_revocations"] = RevocationList(sync_interval=app.config["TOKEN_REVOCATION_SYNC_INTERVAL"])
+
+
+def load_revocations() -> None:
+    """Load the revocation list at startup so the first authenticated request does not query."""
+    current_app.extensions["token_revocations"].load()
+
+
+def _revocations() -> Optional[RevocationList]:
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("token_revocations")
+
+
+def user_revoked_at(user_id: int) -> Optional[float]:
+    """Wall-clock time of the latest revocation of all ``user_id``'s tokens, as seen by this worker."""
+    revocations = _revocations()
+    return revocations.user_cutoff(user_id) if revocations is not None else None
+
+
+@jwt.additional_claims_loader
+def _issue_time_claim(identity) -> dict:
+    return {"iat_ms": int(time.time() * 1000)}
+
+
+@jwt.token_in_blocklist_loader
+def _is_token_revoked(jwt_header: dict, jwt_payload: dict) -> bool:
+    return _revocations().is_revoked(jwt_payload)
+
+
+def revoke_token(payload: dict) -> None:
+    """Revoke one decoded token by its ``jti`` in the current transaction."""
+    _queue(db.session(), {"jti": payload["jti"], "user_id": None, "expires_at": float(payload["exp"])})
+
+
+def revoke_user_tokens(user_id: int, session: Optional[Session] = None) -> None:
+    """Revoke every token issued to ``user_id`` up to now, in the current transaction."""
+    lifetime = current_app.config["JWT_REFRESH_TOKEN_EXPIRES"].total_seconds()
+    _queue(session or db.session(), {"jti": None, "user_id": user_id, "expires_at": time.time() + lifetime})
+
+
+def _queue(session: Session, entry: dict) -> None:
+    session.info.setdefault(_PENDING_KEY, []).append(entry)
+    # Make sure the commit hooks run even when nothing else was written.
+    changes.mark(TokenRevocation, session=session)
+
+
+@changes.before_commit(TokenRevocation)
+def _write_revocations(session: Session, changed) -> None:
+    entries = session.info.get(_PENDING_KEY)
+    if not entries:
+        return
+    now = time.time()
+    for entry in entries:
+        entry["revoked_at"] = now
+    connection = session.connection()
+    connection.execute(insert(TokenRevocation), entries)
+    # Rows whose tokens have all expired are no longer needed.
+    connection.execute(delete(TokenRevocation).where(TokenRevocation.expires_at <= now))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_revocations(session: Session) -> None:
+    entries = session.info.pop(_PENDING_KEY, None)
+    revocations = _revocations()
+    if not entries or revocations is None:
+        return
+
+    def apply() -> None:
+        for entry in entries:
+            revocations.add(entry["jti"], entry["user_id"], entry["revoked_at"], entry["expires_at"])
+
+    changes.when_committed(session, apply)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+@event.listens_for(User, "after_update")
+def _on_user_update(mapper, connection, target) -> None:
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in REVOKING_COLUMNS):
+        revoke_user_tokens(target.id, object_session(target))
+
+
+@event.listens_for(User, "after_delete")
+def _on_user_delete(mapper, connection, target) -> None:
+    revoke_user_tokens(target.id, object_session(target))
@@ -0,0 +1,47 @@
+﻿from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from . import changes, db
+from .models import Employee, LeaveRequest, TableVersion, User
+
+
+VERSIONED_MODELS = (Employee, LeaveRequest, User)
+
+
+def get_table_version(model: type) -> Tuple[int, Optional[datetime]]:
+    """Return ``(version, last modified time in UTC)`` for ``model``'s table with one PK lookup."""
+    row = db.session.execute(
+        select(TableVersion.version, TableVersion.updated_at).where(TableVersion.name == model.__tablename__)
+    ).first()
+    if row is None:
+        return 0, None
+    return row.version, row.updated_at.replace(tzinfo=timezone.utc)
+
+
+def get_table_versions(*models: type) -> Tuple[int, ...]:
+    """Return the write counters of several tables in one query, for use as a cache key."""
+    names = [model.__tablename__ for model in models]
+    versions = dict(
+        db.session.execute(select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(names))).all()
+    )
+    return tuple(versions.get(name, 0) for name in names)
+
+
+@changes.before_commit(*VERSIONED_MODELS)
+def _bump_versions(session: Session, changed) -> None:
+    # Full precision: readers truncate to HTTP dates themselves and need to know when the
+    # second a write landed in is over.
+    now = datetime.utcnow()
+    connection = session.connection()
+    for model in changed:
+        name = model.__tablename__
+        result = connection.execute(
+            update(TableVersion)
+            .where(TableVersion.name == name)
+            .values(version=TableVersion.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(TableVersion).values(name=name, version=1, updated_at=now))
@@ -1,9 +1,13 @@
 ﻿import json
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 
 import pytest
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
 
 from app import create_app, db
-from app.models import User
+from app.models import Employee, LeaveRequest, User
 
 
 @pytest.fixture()
@@ -15,6 +19,8 @@ def app():
             "SECRET_KEY": "test-secret",
             "JWT_SECRET_KEY": "test-jwt-secret",
             "SEED_DEFAULT_DATA": False,
+            # One process, so there are no other workers' revocations to poll for.
+            "TOKEN_REVOCATION_SYNC_INTERVAL": 3600,
         }
     )
 
@@ -45,6 +51,34 @@ def auth_token(app, client):
     return response.get_json()["access_token"]
 
 
+@contextmanager
+def assert_max_queries(app, limit):
+    """Fail if the wrapped block issues more than ``limit`` SQL statements."""
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+    assert len(statements) <= limit, f"{len(statements)} queries executed (limit {limit}):\n" + "\n".join(statements)
+
+
+def _login(app, client, username="boss", password="password123", role="admin"):
+    with app.app_context():
+        user = User(username=username, role=role)
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+    response = client.post("/login", data={"username": username, "password": password})
+    assert response.status_code == 302
+
+
 def test_user_registration_and_login(client):
     payload = {"username": "alice", "password": "securepass"}
     response = client.post("/api/auth/register", data=json.dumps(payload), content_type="application/json")
@@ -100,7 +134,7 @@ def test_crud_operations_with_auth(app, client, auth_token):
 
     list_resp = client.get("/api/employees", headers=headers)
     assert list_resp.status_code == 200
-    assert any(item["id"] == employee_id for item in list_resp.get_json())
+    assert any(item["id"] == employee_id for item in list_resp.get_json()["items"])
 
     update_resp = client.put(
         f"/api/employees/{employee_id}",
@@ -118,4 +152,1297 @@ def test_crud_operations_with_auth(app, client, auth_token):
     assert delete_resp.get_json()["message"] == "Employee deleted."
 
     list_resp = client.get("/api/employees", headers=headers)
-    assert all(item["id"] != employee_id for item in list_resp.get_json())
+    assert all(item["id"] != employee_id for item in list_resp.get_json()["items"])
+
+
+def _create_employees(app, count, **overrides):
+    with app.app_context():
+        for index in range(count):
+            user = User(username=f"staff{index}", role="user")
+            user.password_hash = "not-a-real-hash"
+            fields = {
+                "name": f"Staff {index}",
+                "role": "Barber" if index % 2 else "Stylist",
+                "salary": 1000.0 + index * 100,
+                "start_date": date(2024, 1, 1) + timedelta(days=index),
+                "leave_days": 10,
+            }
+            fields.update(overrides)
+            db.session.add(Employee(user=user, **fields))
+        db.session.commit()
+
+
+def test_list_employees_keyset_pagination_and_filters(app, client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 5)
+
+    first = client.get("/api/employees?limit=2", headers=headers).get_json()
+    assert [item["name"] for item in first["items"]] == ["Staff 0", "Staff 1"]
+    assert first["next_cursor"]
+
+    second = client.get(f"/api/employees?limit=2&after={first['next_cursor']}", headers=headers).get_json()
+    assert [item["name"] for item in second["items"]] == ["Staff 2", "Staff 3"]
+
+    last = client.get(f"/api/employees?limit=2&after={second['next_cursor']}", headers=headers).get_json()
+    assert [item["name"] for item in last["items"]] == ["Staff 4"]
+    assert last["next_cursor"] is None
+
+    filtered = client.get(
+        "/api/employees?role=Barber&salary_min=1000&salary_max=1350&start_date_from=2024-01-02",
+        headers=headers,
+    ).get_json()
+    assert [item["name"] for item in filtered["items"]] == ["Staff 1", "Staff 3"]
+
+    response = client.get("/api/employees?limit=0", headers=headers)
+    assert response.status_code == 400
+    response = client.get("/api/employees?start_date_from=yesterday", headers=headers)
+    assert response.status_code == 400
+
+
+def test_admin_pages_issue_fixed_number_of_queries(app, client):
+    _login(app, client)
+    _create_employees(app, 12)
+    with app.app_context():
+        for employee in Employee.query.all():
+            db.session.add(
+                LeaveRequest(employee=employee, start_date=date(2025, 3, 3), end_date=date(2025, 3, 4))
+            )
+        db.session.commit()
+
+    with assert_max_queries(app, 6):
+        response = client.get("/")
+    assert response.status_code == 200
+    assert b"staff11" in response.data
+
+    with assert_max_queries(app, 6):
+        response = client.get("/admin/manage")
+    assert response.status_code == 200
+    assert b"Linked" in response.data
+
+
+def _create_users(app, count, prefix="new"):
+    with app.app_context():
+        users = [User(username=f"{prefix}{index}", role="user", password_hash="x") for index in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def test_bulk_import_csv_reports_row_errors(app, client, auth_token):
+    user_ids = _create_users(app, 3)
+    body = "\n".join(
+        [
+            "user_id,name,role,salary,start_date,leave_days",
+            f"{user_ids[0]},Abena Boateng,Stylist,5200,2024-03-01,12",
+            f"{user_ids[1]},Kofi Asare,Barber,-1,2024-03-01,",
+            f"{user_ids[2]},Esi Mensah,Receptionist,3900,2024-03-01,",
+            f"{user_ids[2]},Esi Again,Receptionist,3900,2024-03-01,",
+            "9999,Ghost,Barber,3000,2024-03-01,",
+        ]
+    )
+    app.config["BULK_IMPORT_BATCH_SIZE"] = 2
+    response = client.post(
+        "/api/employees/bulk?commit=batch",
+        data=body,
+        headers={"Authorization": f"Bearer {auth_token}", "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report["created"] == 2
+    assert report["failed"] == 3
+    assert [error["row"] for error in report["errors"]] == [2, 4, 5]
+    assert report["errors"][0]["message"] == "salary must be a positive number."
+
+    with app.app_context():
+        esi = Employee.query.filter_by(name="Esi Mensah").one()
+        assert esi.leave_days == 0
+        assert esi.start_date == date(2024, 3, 1)
+
+
+def test_bulk_import_ndjson(app, client, auth_token):
+    user_ids = _create_users(app, 2)
+    lines = [
+        json.dumps({"user_id": user_ids[0], "name": "Adjoa", "role": "Nail Tech", "salary": 4100, "start_date": "2024-05-01"}),
+        "{not json",
+        json.dumps({"user_id": user_ids[1], "name": "Kojo", "role": "Barber", "salary": 4300, "start_date": "05/01/2024"}),
+    ]
+    response = client.post(
+        "/api/employees/bulk",
+        data="\n".join(lines) + "\n",
+        headers={"Authorization": f"Bearer {auth_token}", "Content-Type": "application/x-ndjson"},
+    )
+    report = response.get_json()
+    assert report["created"] == 1
+    assert report["errors"] == [
+        {"row": 2, "message": "Row is not valid JSON."},
+        {"row": 3, "message": "start_date must be in YYYY-MM-DD format."},
+    ]
+
+    lines = [json.dumps({"user_id": value, "name": "X", "role": "Y", "salary": 1, "start_date": "2024-05-01"}) for value in (1.7, True, "  3 ")]
+    report = client.post(
+        "/api/employees/bulk",
+        data="\n".join(lines),
+        headers={"Authorization": f"Bearer {auth_token}", "Content-Type": "application/x-ndjson"},
+    ).get_json()
+    assert report["created"] == 0
+    assert {error["message"] for error in report["errors"]} == {"user_id is required and must be an integer."}
+
+    response = client.post(
+        "/api/employees/bulk",
+        data=b"user_id,name,role,salary,start_date\n1,Ama \xff,Barber,1,2024-05-01\n",
+        headers={"Authorization": f"Bearer {auth_token}", "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Body must be UTF-8 encoded."
+
+    response = client.post(
+        "/api/employees/bulk",
+        data="{}",
+        headers={"Authorization": f"Bearer {auth_token}", "Content-Type": "application/json"},
+    )
+    assert response.status_code == 415
+
+
+def test_export_streams_csv_and_ndjson(app, client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 3)
+    with app.app_context():
+        employee = Employee.query.first()
+        db.session.add(LeaveRequest(employee=employee, start_date=date(2025, 1, 6), end_date=date(2025, 1, 7)))
+        db.session.commit()
+
+    response = client.get("/api/employees/export?format=csv", headers=headers)
+    assert response.status_code == 200
+    assert response.is_streamed
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].startswith("id,user_id,name,role,salary")
+    assert len(lines) == 4
+
+    response = client.get("/api/leave-requests/export?format=ndjson", headers=headers)
+    assert response.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert records[0]["start_date"] == "2025-01-06"
+
+    assert client.get("/api/employees/export?format=xml", headers=headers).status_code == 400
+
+
+def test_seed_skips_entries_that_are_already_applied(app, monkeypatch):
+    from app.seed import seed_defaults
+
+    hashed = []
+    original = User.set_password
+
+    def counting_set_password(user, password):
+        hashed.append(user.username)
+        original(user, password)
+
+    monkeypatch.setattr(User, "set_password", counting_set_password)
+
+    with app.app_context():
+        seed_defaults()
+        assert len(hashed) == 5
+        assert User.query.count() == 5
+
+        seed_defaults()
+        assert len(hashed) == 5
+
+
+def test_upgrade_schema_is_noop_when_current(app):
+    from app.migrations import SCHEMA_VERSION, get_meta, upgrade_schema
+
+    with app.app_context():
+        assert get_meta("schema_version") == str(SCHEMA_VERSION)
+        assert upgrade_schema() == SCHEMA_VERSION
+
+
+def test_principal_cache_skips_user_lookup_and_invalidates_on_role_change(app, client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.get("/api/employees", headers=headers)
+
+    with assert_max_queries(app, 2) as statements:
+        assert client.get("/api/employees", headers=headers).status_code == 200
+    assert not any("FROM user" in statement for statement in statements)
+
+    with app.app_context():
+        User.query.filter_by(username="tester").one().role = "user"
+        db.session.commit()
+    # The role change revokes the old token; a fresh login sees the new role.
+    assert client.get("/api/employees/export", headers=headers).status_code == 401
+    token = client.post(
+        "/api/auth/login",
+        data=json.dumps({"username": "tester", "password": "password123"}),
+        content_type="application/json",
+    ).get_json()["access_token"]
+    assert client.get("/api/employees/export", headers={"Authorization": f"Bearer {token}"}).status_code == 403
+
+
+def test_principal_cache_honours_revocations_from_other_workers(app):
+    import time
+
+    from sqlalchemy import update
+
+    from app.principals import get_principal
+
+    _login(app, client=app.test_client())
+    with app.app_context():
+        user_id = User.query.filter_by(username="boss").one().id
+        assert get_principal(user_id).role == "admin"
+        # Another worker demotes the user: this process sees neither the ORM event nor the commit.
+        db.session.execute(update(User).where(User.id == user_id).values(role="user"))
+        db.session.commit()
+        assert get_principal(user_id).role == "admin"
+
+        app.extensions["token_revocations"].add(None, user_id, time.time(), time.time() + 60)
+        assert get_principal(user_id).role == "user"
+
+
+def test_trusted_role_claim_avoids_user_lookup(app, client, auth_token):
+    app.config["JWT_TRUST_ROLE_CLAIM"] = True
+    with app.app_context():
+        app.extensions["principal_cache"].clear()
+
+    with assert_max_queries(app, 2) as statements:
+        assert client.get("/api/employees", headers={"Authorization": f"Bearer {auth_token}"}).status_code == 200
+    assert not any("FROM user" in statement for statement in statements)
+
+
+def test_cached_session_user_can_lazy_load_profile(app, client):
+    _login(app, client, username="kofi", role="user")
+    with app.app_context():
+        user = User.query.filter_by(username="kofi").one()
+        db.session.add(Employee(user=user, name="Kofi Boateng", role="Barber", salary=3000, leave_days=5))
+        db.session.commit()
+
+    for _ in range(2):
+        response = client.get("/")
+        assert response.status_code == 200
+        assert b"Kofi Boateng" in response.data
+
+
+def test_dashboard_stats_use_aggregates_and_invalidate_on_write(app):
+    from sqlalchemy import update
+
+    from app.models import TableVersion
+    from app.stats import get_dashboard_stats
+
+    _create_employees(app, 3)
+    with app.app_context():
+        db.session.add(User(username="second.admin", role="Admin", password_hash="x"))
+        db.session.add(LeaveRequest(employee_id=1, start_date=date(2025, 2, 3), end_date=date(2025, 2, 4)))
+        db.session.commit()
+
+        stats = get_dashboard_stats()
+        assert (stats.headcount, stats.pending_leave, stats.admin_count) == (3, 1, 1)
+        assert stats.payroll_total == 1000.0 + 1100.0 + 1200.0
+
+        # Only the table-version lookup that keys the snapshot.
+        with assert_max_queries(app, 1):
+            assert get_dashboard_stats() is stats
+
+        # A write from another worker skips this process's commit hooks but still bumps the version.
+        db.session.execute(update(TableVersion).where(TableVersion.name == "user").values(version=TableVersion.version + 1))
+        db.session.execute(update(User).where(User.username == "second.admin").values(role="user"))
+        db.session.commit()
+        assert get_dashboard_stats().admin_count == 0
+
+        LeaveRequest.query.one().status = "approved"
+        db.session.commit()
+        assert get_dashboard_stats().pending_leave == 0
+
+
+def test_flushed_changes_record_inserted_ids_and_skip_relationship_only_dirt(app):
+    _create_employees(app, 1)
+    with app.app_context():
+        employee = db.session.get(Employee, 1)
+        leave = LeaveRequest(employee=employee, start_date=date(2025, 3, 3), end_date=date(2025, 3, 4))
+        db.session.add(leave)
+        db.session.flush()
+        assert db.session.info["pending_changes"] == {LeaveRequest: {leave.id}}
+        db.session.rollback()
+
+
+def test_leave_queue_is_keyset_paginated_by_status(app, client):
+    from app.routes import LEAVE_PAGE_SIZE
+
+    _login(app, client)
+    _create_employees(app, 1)
+    with app.app_context():
+        for index in range(LEAVE_PAGE_SIZE + 5):
+            db.session.add(
+                LeaveRequest(
+                    employee_id=1,
+                    start_date=date(2025, 4, 1),
+                    end_date=date(2025, 4, 2),
+                    reason=f"trip {index:02d}",
+                    status="approved" if index == 0 else "pending",
+                    requested_at=datetime(2025, 1, 1) + timedelta(hours=index),
+                )
+            )
+        db.session.commit()
+
+    first = client.get("/").get_data(as_text=True)
+    assert f"trip {LEAVE_PAGE_SIZE + 4:02d}" in first
+    assert "trip 01" not in first and "trip 00" not in first
+    assert "Older requests" in first
+
+    second = client.get("/?after=2025-01-01T05:00:00_6").get_data(as_text=True)
+    assert "trip 04" in second and "trip 01" in second
+    assert "trip 05" not in second and "Older requests" not in second
+
+    approved = client.get("/?queue=approved").get_data(as_text=True)
+    assert "trip 00" in approved and "trip 01" not in approved
+
+    assert client.get("/?after=garbage").status_code == 200
+
+
+def test_leave_request_api_and_bulk_decisions(app, client, auth_token):
+    admin_headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 1)
+    with app.app_context():
+        staff = User.query.filter_by(username="staff0").one()
+        staff.set_password("password123")
+        db.session.commit()
+    staff_token = client.post(
+        "/api/auth/login", json={"username": "staff0", "password": "password123"}
+    ).get_json()["access_token"]
+    staff_headers = {"Authorization": f"Bearer {staff_token}"}
+
+    created = []
+    for day in (3, 10, 17):
+        response = client.post(
+            "/api/leave-requests",
+            json={"start_date": f"2025-03-{day:02d}", "end_date": f"2025-03-{day + 1:02d}", "reason": "rest"},
+            headers=staff_headers,
+        )
+        assert response.status_code == 201
+        created.append(response.get_json()["id"])
+
+    response = client.post(
+        "/api/leave-requests", json={"start_date": "2025-03-05", "end_date": "2025-03-01"}, headers=staff_headers
+    )
+    assert response.status_code == 400
+    for employee_id in ("1", 1.0, [1], {"id": 1}, True):
+        response = client.post(
+            "/api/leave-requests",
+            json={"employee_id": employee_id, "start_date": "2025-04-01", "end_date": "2025-04-02"},
+            headers=admin_headers,
+        )
+        assert response.status_code == 400
+
+    assert client.post(
+        "/api/leave-requests/decisions", json={"ids": created, "decision": "approve"}, headers=staff_headers
+    ).status_code == 403
+    assert client.get("/api/leave/coverage?from=2025-03-01&to=2025-03-31", headers=staff_headers).status_code == 403
+
+    # JSON booleans are ints in Python; true must not be read as leave request 1.
+    for ids in ([True], [created[0], False], []):
+        response = client.post(
+            "/api/leave-requests/decisions", json={"ids": ids, "decision": "approve"}, headers=admin_headers
+        )
+        assert response.status_code == 400
+
+    response = client.post(
+        "/api/leave-requests/decisions",
+        json={"ids": created[:2] + [999], "decision": "approve"},
+        headers=admin_headers,
+    )
+    assert [item["outcome"] for item in response.get_json()["results"]] == ["approved", "approved", "not_found"]
+
+    response = client.post(
+        "/api/leave-requests/decisions", json={"ids": created, "decision": "reject"}, headers=admin_headers
+    )
+    outcomes = [item["outcome"] for item in response.get_json()["results"]]
+    assert outcomes == ["already_approved", "already_approved", "rejected"]
+
+    with app.app_context():
+        decided = db.session.get(LeaveRequest, created[2])
+        assert decided.status == "rejected" and decided.decided_at is not None
+
+    page = client.get("/api/leave-requests?status=approved&limit=1", headers=staff_headers).get_json()
+    assert len(page["items"]) == 1 and page["next_cursor"]
+    page = client.get(f"/api/leave-requests?status=approved&after={page['next_cursor']}", headers=staff_headers).get_json()
+    assert len(page["items"]) == 1 and page["next_cursor"] is None
+
+
+def test_dashboard_bulk_decision_form(app, client):
+    _login(app, client)
+    _create_employees(app, 1)
+    with app.app_context():
+        requests = [LeaveRequest(employee_id=1, start_date=date(2025, 5, 5), end_date=date(2025, 5, 6)) for _ in range(3)]
+        db.session.add_all(requests)
+        db.session.commit()
+        ids = [item.id for item in requests]
+
+    response = client.post("/leave-requests/decide", data={"ids": ids[:2], "decision": "approve"}, follow_redirects=True)
+    assert b"2 leave request(s) approved." in response.data
+
+    response = client.post(f"/leave-requests/{ids[2]}/reject", follow_redirects=True)
+    assert b"Leave request rejected." in response.data
+    response = client.post(f"/leave-requests/{ids[2]}/approve", follow_redirects=True)
+    assert b"already been rejected" in response.data
+    assert client.post("/leave-requests/999/approve").status_code == 404
+
+
+def test_leave_balances_count_working_days_and_holidays(app, client, auth_token):
+    from app.leave import compute_balances, init_app
+
+    app.config["LEAVE_HOLIDAYS"] = ["2025-03-06"]
+    init_app(app)
+    _create_employees(app, 3)
+    with app.app_context():
+        db.session.add_all(
+            [
+                # Mon 3 Mar - Sun 9 Mar 2025: five weekdays minus the Thursday holiday.
+                LeaveRequest(employee_id=1, start_date=date(2025, 3, 3), end_date=date(2025, 3, 9), status="approved"),
+                # Straddles New Year: only the 2025 weekdays (Wed 1 - Fri 3 Jan) count.
+                LeaveRequest(employee_id=1, start_date=date(2024, 12, 30), end_date=date(2025, 1, 3), status="approved"),
+                LeaveRequest(employee_id=2, start_date=date(2025, 6, 2), end_date=date(2025, 6, 3), status="pending"),
+                LeaveRequest(employee_id=3, start_date=date(2025, 6, 2), end_date=date(2025, 6, 3), status="rejected"),
+            ]
+        )
+        db.session.commit()
+
+        with assert_max_queries(app, 2):
+            balances = {balance.employee_id: balance for balance in compute_balances(2025)}
+        assert (balances[1].used, balances[1].remaining) == (7, 3)
+        assert (balances[2].used, balances[2].pending, balances[2].remaining) == (0, 2, 10)
+        assert (balances[3].used, balances[3].pending) == (0, 0)
+
+    response = client.get("/api/leave/balances?year=2025&employee_id=1", headers={"Authorization": f"Bearer {auth_token}"})
+    assert response.get_json()["items"][0]["remaining"] == 3
+
+
+def test_sorted_intervals_window_query():
+    from app.intervals import LeaveInterval, SortedIntervals
+
+    intervals = SortedIntervals()
+    intervals.add(LeaveInterval(1, 1, date(2025, 1, 1), date(2025, 1, 20), "approved"))
+    intervals.add(LeaveInterval(2, 2, date(2025, 1, 10), date(2025, 1, 11), "pending"))
+    intervals.add(LeaveInterval(3, 3, date(2025, 2, 1), date(2025, 2, 2), "approved"))
+
+    assert [item.request_id for item in intervals.overlapping(date(2025, 1, 15), date(2025, 1, 31))] == [1]
+    assert [item.request_id for item in intervals.overlapping(date(2025, 1, 11), date(2025, 2, 1))] == [1, 2, 3]
+    intervals.remove(1)
+    assert intervals.overlapping(date(2025, 1, 15), date(2025, 1, 31)) == []
+    # Dropping the longest interval narrows the scan window back to the remaining ones.
+    assert intervals._max_length == 1
+
+
+def test_overlapping_leave_rejected_and_coverage_reported(app, client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 2)
+
+    def submit(employee_id, start, end):
+        return client.post(
+            "/api/leave-requests",
+            json={"employee_id": employee_id, "start_date": start, "end_date": end},
+            headers=headers,
+        )
+
+    first = submit(1, "2025-07-07", "2025-07-09")
+    assert first.status_code == 201
+    assert submit(1, "2025-07-09", "2025-07-10").status_code == 409
+    assert submit(2, "2025-07-09", "2025-07-10").status_code == 201
+
+    client.post("/api/leave-requests/decisions", json={"ids": [first.get_json()["id"]], "decision": "reject"}, headers=headers)
+    assert submit(1, "2025-07-09", "2025-07-10").status_code == 201
+
+    response = client.get("/api/leave/coverage?from=2025-07-08&to=2025-07-11", headers=headers)
+    days = {day["date"]: day["absent"] for day in response.get_json()["days"]}
+    assert [day["count"] for day in response.get_json()["days"]] == [0, 2, 2, 0]
+    assert days["2025-07-08"] == []
+    assert sorted(item["name"] for item in days["2025-07-09"]) == ["Staff 0", "Staff 1"]
+    assert sorted(item["employee_id"] for item in days["2025-07-10"]) == [1, 2]
+    assert days["2025-07-11"] == []
+
+    assert client.get("/api/leave/coverage?from=2025-07-08", headers=headers).status_code == 400
+
+    # New requests are added to the warm index by id instead of forcing a full reload.
+    index = app.extensions["leave_index"]
+    loaded_at = index._loaded_at
+    assert submit(1, "2025-07-14", "2025-07-14").status_code == 201
+    response = client.get("/api/leave/coverage?from=2025-07-14&to=2025-07-14", headers=headers)
+    assert [item["employee_id"] for item in response.get_json()["days"][0]["absent"]] == [1]
+    assert index._loaded_at == loaded_at
+
+    # Leave booked by another worker is invisible to this process's index but still blocks overlaps.
+    with app.app_context():
+        db.session.execute(
+            LeaveRequest.__table__.insert().values(
+                employee_id=2,
+                start_date=date(2025, 8, 4),
+                end_date=date(2025, 8, 8),
+                status="approved",
+                requested_at=datetime(2025, 7, 1),
+            )
+        )
+        db.session.commit()
+    assert submit(2, "2025-08-06", "2025-08-06").status_code == 409
+
+
+def test_payroll_report_groups_and_percentiles(app, client, auth_token):
+    from sqlalchemy import update
+
+    from app.models import TableVersion
+    from app.reports import build_payroll_report
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 5)
+    with app.app_context():
+        report = build_payroll_report(today=date(2026, 1, 1))
+    assert report["headcount"] == 5
+    assert report["total"] == 1000 + 1100 + 1200 + 1300 + 1400
+    assert report["percentiles"]["p50"] == 1200
+    by_role = {group["role"]: group for group in report["by_role"]}
+    assert by_role["Stylist"]["headcount"] == 3
+    assert by_role["Stylist"]["percentiles"]["p50"] == 1200
+    assert by_role["Stylist"]["percentiles"]["p25"] == 1100
+    assert by_role["Barber"]["mean"] == 1200
+    assert report["by_tenure"] == [{"band": "1-3y", "headcount": 5, "total": 6000.0, "mean": 1200.0}]
+
+    first = client.get("/api/reports/payroll", headers=headers).get_json()
+    with assert_max_queries(app, 1):
+        assert client.get("/api/reports/payroll", headers=headers).get_json() == first
+
+    with app.app_context():
+        db.session.get(Employee, 1).salary = 2000
+        db.session.commit()
+    assert client.get("/api/reports/payroll", headers=headers).get_json()["total"] == 7000
+
+    # Another worker's write bumps the table version without running this process's commit hooks.
+    with app.app_context():
+        db.session.execute(update(Employee).where(Employee.id == 1).values(salary=1000))
+        db.session.execute(update(TableVersion).where(TableVersion.name == "employee").values(version=TableVersion.version + 1))
+        db.session.commit()
+    assert client.get("/api/reports/payroll", headers=headers).get_json()["total"] == 6000
+
+
+def _backdate_table_version(app, name, seconds=60):
+    from sqlalchemy import update
+
+    from app.models import TableVersion
+
+    with app.app_context():
+        db.session.execute(
+            update(TableVersion)
+            .where(TableVersion.name == name)
+            .values(updated_at=datetime.utcnow() - timedelta(seconds=seconds))
+        )
+        db.session.commit()
+
+
+def test_employee_api_conditional_get(app, client, auth_token):
+    from app.versions import get_table_version
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 2)
+    _backdate_table_version(app, "employee")
+    with app.app_context():
+        employee_version = get_table_version(Employee)[0]
+
+    first = client.get("/api/employees", headers=headers)
+    etag = first.headers["ETag"]
+    assert first.last_modified is not None
+
+    with assert_max_queries(app, 1):
+        response = client.get("/api/employees", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    response = client.get("/api/employees", headers={**headers, "If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == 304
+
+    other_page = client.get("/api/employees?limit=1", headers={**headers, "If-None-Match": etag})
+    assert other_page.status_code == 200
+
+    detail = client.get("/api/employees/1", headers=headers)
+    assert detail.get_json()["name"] == "Staff 0"
+    assert not detail.headers["ETag"].startswith("W/")
+    assert detail.last_modified is not None
+    assert client.get("/api/employees/1", headers={**headers, "If-None-Match": detail.headers["ETag"]}).status_code == 304
+    response = client.get("/api/employees/1", headers={**headers, "If-Modified-Since": detail.headers["Last-Modified"]})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == detail.headers["ETag"]
+
+    # Submitting leave only touches the employee through a backref, so the list stays cached.
+    response = client.post(
+        "/api/leave-requests",
+        json={"employee_id": 1, "start_date": "2025-06-02", "end_date": "2025-06-03"},
+        headers=headers,
+    )
+    assert response.status_code == 201
+    with app.app_context():
+        assert get_table_version(Employee)[0] == employee_version
+    assert client.get("/api/employees", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    client.put("/api/employees/1", json={"salary": 999}, headers=headers)
+    response = client.get("/api/employees", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    _backdate_table_version(app, "employee", seconds=30)
+    response = client.get("/api/employees/1", headers={**headers, "If-Modified-Since": detail.headers["Last-Modified"]})
+    assert response.status_code == 200
+    assert response.get_json()["salary"] == 999
+    assert client.get("/api/employees/42", headers=headers).status_code == 404
+
+
+def test_employee_list_last_modified_ignores_same_second_writes(app, client, auth_token):
+    from email.utils import format_datetime
+
+    from app.versions import get_table_version
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 1)
+    # A date from the current second cannot rule out a later write in that same second.
+    assert client.get("/api/employees", headers=headers).last_modified is None
+
+    with app.app_context():
+        current_second = get_table_version(Employee)[1].replace(microsecond=0)
+    client.patch("/api/employees/1", json={"salary": 999}, headers=headers)
+    response = client.get(
+        "/api/employees",
+        headers={**headers, "If-Modified-Since": format_datetime(current_second, usegmt=True)},
+    )
+    assert response.status_code == 200
+    assert response.get_json()["items"][0]["salary"] == 999
+
+
+def test_employee_updates_use_optimistic_concurrency(app, client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 1)
+
+    detail = client.get("/api/employees/1", headers=headers)
+    etag = detail.headers["ETag"]
+    assert detail.get_json()["version"] == 1
+
+    response = client.patch("/api/employees/1", json={"salary": 1500}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["salary"] == 1500
+    assert response.get_json()["name"] == "Staff 0"
+    assert response.get_json()["version"] == 2
+    assert response.headers["ETag"] != etag
+
+    stale = client.patch("/api/employees/1", json={"salary": 900}, headers={**headers, "If-Match": etag})
+    assert stale.status_code == 412
+    assert stale.get_json()["current"]["salary"] == 1500
+    stale = client.put("/api/employees/1", json={"salary": 900, "version": 1}, headers=headers)
+    assert stale.status_code == 409
+    assert client.get("/api/employees/1", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+    with app.app_context():
+        first = db.session.get(Employee, 1)
+        other_session = db.session.session_factory()
+        second = other_session.get(Employee, 1)
+        first.salary = 2000
+        db.session.commit()
+        second.salary = 3000
+        with pytest.raises(StaleDataError):
+            other_session.commit()
+        other_session.close()
+        assert db.session.get(Employee, 1).version == 3
+
+    _login(app, client)
+    form = {"name": "Staff 0", "role": "Stylist", "salary": "2500", "version": "2"}
+    response = client.post("/employees/1/edit", data=form)
+    assert response.status_code == 409
+    assert b'name="version" value="3"' in response.data
+    response = client.post("/employees/1/edit", data={**form, "version": "3"})
+    assert response.status_code == 302
+
+    with app.app_context():
+        leave = LeaveRequest(employee_id=1, start_date=date(2025, 3, 3), end_date=date(2025, 3, 4))
+        db.session.add(leave)
+        db.session.commit()
+        leave_id = leave.id
+    response = client.post("/api/leave-requests/decisions", json={"ids": [leave_id], "decision": "approve"}, headers=headers)
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(LeaveRequest, leave_id).version == 2
+
+
+def test_sparse_fieldsets_project_columns(app, client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 3)
+
+    with assert_max_queries(app, 3) as statements:
+        response = client.get("/api/employees?fields=name,role&limit=2", headers=headers)
+    page = response.get_json()
+    assert page["items"] == [{"name": "Staff 0", "role": "Stylist"}, {"name": "Staff 1", "role": "Barber"}]
+    assert page["next_cursor"] == "2"
+    employee_select = next(statement for statement in statements if "FROM employee" in statement)
+    assert "salary" not in employee_select and "created_at" not in employee_select
+
+    full = client.get("/api/employees?limit=1", headers=headers).get_json()["items"][0]
+    with app.app_context():
+        assert full == db.session.get(Employee, 1).as_dict()
+
+    assert client.get("/api/employees?fields=name,password", headers=headers).status_code == 400
+
+    response = client.get("/api/employees/export?format=csv&fields=id,salary_currency", headers=headers)
+    assert response.get_data(as_text=True).splitlines()[:2] == ["id,salary_currency", "1,GHS"]
+
+    client.post("/api/leave-requests", json={"employee_id": 1, "start_date": "2025-08-04", "end_date": "2025-08-05"}, headers=headers)
+    items = client.get("/api/leave-requests?fields=status,start_date", headers=headers).get_json()["items"]
+    assert items == [{"start_date": "2025-08-04", "status": "pending"}]
+
+
+def test_production_profile_serves_concurrent_reads_and_writes(tmp_path):
+    import threading
+
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'prod.db'}",
+            "SECRET_KEY": "test-secret",
+            "JWT_SECRET_KEY": "test-jwt-secret",
+            "SEED_DEFAULT_DATA": False,
+            "DB_PROFILE": "production",
+            "DB_POOL_SIZE": 4,
+            "DB_READ_SPLIT": True,
+        }
+    )
+    with app.app_context():
+        assert db.session.execute(db.text("PRAGMA journal_mode")).scalar() == "wal"
+    read_engine = app.extensions["read_engine"]
+    _create_employees(app, 5)
+
+    client = app.test_client()
+    client.post(
+        "/api/auth/register",
+        data=json.dumps({"username": "tester", "password": "password123", "role": "admin"}),
+        content_type="application/json",
+    )
+    token = client.post(
+        "/api/auth/login",
+        data=json.dumps({"username": "tester", "password": "password123"}),
+        content_type="application/json",
+    ).get_json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    reads = []
+
+    def _count_read(conn, cursor, statement, parameters, context, executemany):
+        reads.append(statement)
+
+    event.listen(read_engine, "before_cursor_execute", _count_read)
+    statuses = []
+
+    def _reader():
+        local = app.test_client()
+        for _ in range(10):
+            statuses.append(local.get("/api/employees", headers=headers).status_code)
+
+    def _writer(offset):
+        local = app.test_client()
+        for i in range(5):
+            response = local.post(
+                "/api/auth/register",
+                data=json.dumps({"username": f"w{offset}-{i}", "password": "password123"}),
+                content_type="application/json",
+            )
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=_reader) for _ in range(3)]
+    threads += [threading.Thread(target=_writer, args=(n,)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    event.remove(read_engine, "before_cursor_execute", _count_read)
+
+    assert statuses.count(200) == 30
+    assert statuses.count(201) == 10
+    assert reads
+    with app.app_context():
+        assert User.query.filter(User.username.like("w%")).count() == 10
+        db.session.remove()
+        db.engine.dispose()
+    read_engine.dispose()
+
+
+def test_serve_command_preloads_app_for_gunicorn(app, monkeypatch, tmp_path):
+    from app import server
+
+    app.config["METRICS_DIR"] = str(tmp_path)
+    (tmp_path / "metrics-1-1.json").write_text("{}")
+    calls = []
+    monkeypatch.setattr(server, "run", lambda application, options: calls.append((application, options)))
+
+    result = app.test_cli_runner().invoke(args=["serve", "--workers", "3", "--threads", "2", "--keepalive", "10"])
+
+    assert result.exit_code == 0, result.output
+    application, options = calls[0]
+    assert application is app
+    assert options["workers"] == 3
+    assert options["threads"] == 2
+    assert options["worker_class"] == "gthread"
+    assert options["keepalive"] == 10
+    assert options["preload_app"] is True
+    # Workers share metrics through a directory cleared of the previous run's files.
+    assert app.extensions["metrics"].directory == str(tmp_path)
+    assert list(tmp_path.iterdir()) == []
+    assert server.build_options("127.0.0.1:8000", 1, 1, 2, 30, 30, 0)["worker_class"] == "sync"
+
+
+def test_job_pool_starts_after_fork_not_on_requests(app, client):
+    from types import SimpleNamespace
+
+    from app import server
+    from app.jobs import JobWorker
+
+    worker = JobWorker(app)
+    app.extensions["job_worker"] = worker
+    client.get("/login")
+    worker.wake()
+    assert worker._thread is None
+
+    started = []
+    app.extensions["job_worker"] = SimpleNamespace(start=lambda: started.append(True))
+    server._post_fork(None, SimpleNamespace(app=SimpleNamespace(callable=app)))
+    assert started == [True]
+
+
+def test_leave_notifications_run_as_background_jobs(app, client, auth_token, caplog):
+    import logging
+
+    from app import jobs
+    from app.models import Job
+
+    _create_employees(app, 1)
+    with app.app_context():
+        employee_id = Employee.query.first().id
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post(
+        "/api/leave-requests",
+        data=json.dumps({"employee_id": employee_id, "start_date": "2025-03-03", "end_date": "2025-03-04"}),
+        content_type="application/json",
+        headers=headers,
+    )
+    assert response.status_code == 201
+    request_id = response.get_json()["id"]
+    client.post(
+        "/api/leave-requests/decisions",
+        data=json.dumps({"ids": [request_id], "decision": "approve"}),
+        content_type="application/json",
+        headers=headers,
+    )
+
+    with app.app_context():
+        assert [job.name for job in Job.query.order_by(Job.id)] == ["leave.notify_submitted", "leave.notify_decided"]
+        with caplog.at_level(logging.INFO, logger="app.notifications"):
+            outcomes = jobs.run_pending()
+        assert list(outcomes.values()) == ["done", "done"]
+        # The request was decided before the worker ran, so only the decision is announced.
+        assert "awaiting review" not in caplog.text
+        assert f"Staff 0, your leave request {request_id} (2025-03-03 to 2025-03-04) was approved." in caplog.text
+        assert jobs.run_pending() == {}
+
+
+def test_failed_jobs_retry_with_backoff_then_fail(app):
+    from app import jobs
+    from app.models import Job
+
+    attempts = []
+
+    @jobs.handler("test.flaky")
+    def _flaky(fail_times):
+        attempts.append(1)
+        if len(attempts) <= fail_times:
+            raise RuntimeError("boom")
+
+    try:
+        with app.app_context():
+            job = jobs.enqueue("test.flaky", max_attempts=2, fail_times=5)
+            db.session.rollback()
+            assert Job.query.count() == 0
+
+            job = jobs.enqueue("test.flaky", max_attempts=2, fail_times=5)
+            db.session.commit()
+            assert jobs.run_pending() == {job.id: "queued"}
+            db.session.refresh(job)
+            assert job.attempts == 1 and job.last_error == "RuntimeError: boom"
+            assert job.run_at > datetime.utcnow()
+            assert jobs.run_pending() == {}
+
+            job.run_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            assert jobs.run_pending() == {job.id: "failed"}
+            db.session.refresh(job)
+            assert (job.status, job.attempts) == ("failed", 2)
+    finally:
+        jobs.HANDLERS.pop("test.flaky", None)
+
+
+def test_audit_log_records_diffs_in_batches(app, client, auth_token):
+    from sqlalchemy.exc import DatabaseError
+
+    from app.models import AuditEvent
+
+    headers = {"Authorization": f"Bearer {auth_token}", "Content-Type": "application/json"}
+    with app.app_context():
+        admin_id = User.query.filter_by(username="tester").first().id
+    _create_employees(app, 1)
+    with app.app_context():
+        employee = Employee.query.first()
+        employee_id = employee.id
+        db.session.add(LeaveRequest(employee=employee, start_date=date(2025, 3, 3), end_date=date(2025, 3, 4)))
+        db.session.commit()
+        leave_id = LeaveRequest.query.first().id
+
+    client.put(f"/api/employees/{employee_id}", data=json.dumps({"salary": 2500}), headers=headers)
+    client.post("/api/leave-requests/decisions", data=json.dumps({"ids": [leave_id], "decision": "approve"}), headers=headers)
+    client.delete(f"/api/employees/{employee_id}", headers=headers)
+
+    with app.app_context():
+        # Committed events wait in the buffer until a batch is written.
+        assert AuditEvent.query.count() == 0
+        assert len(app.extensions["audit_buffer"]) > 0
+
+    response = client.get(f"/api/audit?entity=employee&entity_id={employee_id}", headers=headers)
+    assert response.status_code == 200
+    events = response.get_json()["items"]
+    assert [event["action"] for event in events] == ["delete", "update", "create"]
+    assert events[1]["changes"] == {"salary": [1000.0, 2500.0]}
+    assert events[1]["actor_id"] == admin_id
+    assert events[2]["actor_id"] is None
+
+    leave_events = client.get(f"/api/audit?entity=leave_request&entity_id={leave_id}", headers=headers).get_json()["items"]
+    # Deleting the employee cascades to their leave, so the decision is the middle event.
+    assert [event["action"] for event in leave_events] == ["delete", "update", "create"]
+    assert leave_events[1]["changes"]["status"] == ["pending", "approved"]
+
+    users = client.get("/api/audit?entity=user", headers=headers).get_json()["items"]
+    assert users[-1]["changes"]["password_hash"] == [None, "***"]
+
+    future = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    assert client.get(f"/api/audit?from={future}", headers=headers).get_json()["items"] == []
+    assert client.get("/api/audit?entity=salary", headers=headers).status_code == 400
+
+    with app.app_context():
+        with pytest.raises(DatabaseError, match="append-only"):
+            db.session.execute(db.text("DELETE FROM audit_event"))
+        db.session.rollback()
+
+
+def test_audit_rows_are_not_duplicated_into_forked_workers(app):
+    import os
+    from types import SimpleNamespace
+
+    from app import server
+    from app.audit import AuditBuffer
+    from app.models import AuditEvent
+
+    row = {"ts": datetime(2025, 1, 1), "entity": "user", "entity_id": 1, "action": "create", "actor_id": None, "changes": "{}"}
+    buffer = AuditBuffer(app, background=False)
+    buffer.extend([row, row])
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover - runs in the child
+        os._exit(0 if len(buffer) == 0 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert len(buffer) == 2
+
+    # flask serve writes the master's buffered events once, before forking workers.
+    app.extensions["audit_buffer"] = buffer
+    server._pre_fork(None, SimpleNamespace(app=SimpleNamespace(callable=app)))
+    assert len(buffer) == 0
+    with app.app_context():
+        assert AuditEvent.query.count() == 2
+
+
+def test_employee_search_prefix_typo_and_sync(app, client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    _create_employees(app, 4)
+    with app.app_context():
+        user = User(username="kmensah", password_hash="not-a-real-hash")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Employee(user_id=user.id, name="Kwame Mensah", role="Accountant", salary=5000, leave_days=10))
+        db.session.commit()
+        kwame_id = Employee.query.filter_by(name="Kwame Mensah").first().id
+
+    def search(query):
+        response = client.get("/api/employees/search", query_string={"q": query}, headers=headers)
+        assert response.status_code == 200
+        return [item["id"] for item in response.get_json()["items"]]
+
+    assert search("kwa") == [kwame_id]
+    assert search("mensha") == [kwame_id]
+    assert search("kmensah") == [kwame_id]
+    assert len(search("barber")) == 2
+    assert len(search("stylst staff")) == 2
+    assert search("accountant zzz") == []
+    assert client.get("/api/employees/search", headers=headers).status_code == 400
+
+    client.put(f"/api/employees/{kwame_id}", data=json.dumps({"name": "Ama Owusu"}), content_type="application/json", headers=headers)
+    assert search("kwame") == []
+    assert search("owusu") == [kwame_id]
+    with app.app_context():
+        User.query.filter_by(username="kmensah").first().username = "aowusu"
+        db.session.commit()
+    assert search("aowusu") == [kwame_id]
+
+    # Inserts are indexed by id; only bulk Core statements force a full reload.
+    index = app.extensions["employee_search"]
+    loaded_at = index._loaded_at
+    with app.app_context():
+        user = User(username="efua", password_hash="not-a-real-hash")
+        db.session.add(Employee(user=user, name="Efua Sarpong", role="Stylist", salary=4000, leave_days=10))
+        db.session.commit()
+        efua_id = Employee.query.filter_by(name="Efua Sarpong").one().id
+    assert search("sarpong") == [efua_id]
+    assert index._loaded_at == loaded_at
+
+    _login(app, client)
+    page = client.get("/?q=owusu").get_data(as_text=True)
+    assert "Ama Owusu" in page and "Staff 1" not in page
+
+
+def test_synthetic_data_and_benchmark_harness(app):
+    from app import benchmark
+
+    result = app.test_cli_runner().invoke(args=["synth", "--employees", "20", "--leave-requests", "200", "--batch-size", "7"])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert Employee.query.count() == 20
+        assert LeaveRequest.query.count() == 200
+        # Requests are laid out back to back per employee, so none overlap.
+        employee_id = Employee.query.first().id
+        periods = [(r.start_date, r.end_date) for r in LeaveRequest.query.filter_by(employee_id=employee_id).order_by(LeaveRequest.start_date)]
+        assert all(previous[1] < current[0] for previous, current in zip(periods, periods[1:]))
+        # One shared hash rather than one KDF run per user.
+        assert db.session.query(User.password_hash).filter(User.username.like("synth%")).distinct().count() == 1
+
+    results = benchmark.run_benchmarks(app, iterations=5, warmup=1, memory_iterations=1)
+    summaries = {result.name: result.summary() for result in results}
+    assert set(summaries) == set(benchmark.DEFAULT_THRESHOLDS)
+    for summary in summaries.values():
+        assert summary["errors"] == 0
+        assert summary["p50_ms"] <= summary["p95_ms"] <= summary["p99_ms"]
+        assert summary["peak_kib"] > 0
+    assert summaries["employees.list"]["max_queries"] >= 1
+
+    violations = benchmark.check_thresholds(results, {"employees.list": {"max_queries": 0}})
+    assert violations == [f"employees.list: max_queries {summaries['employees.list']['max_queries']} exceeds 0"]
+
+
+def test_server_timing_header_and_prometheus_metrics(app, client, auth_token):
+    import re
+
+    _create_employees(app, 3)
+    response = client.get("/api/employees", headers={"Authorization": f"Bearer {auth_token}"})
+    timing = response.headers["Server-Timing"]
+    queries = int(re.search(r'db;desc="(\d+) queries";dur=[\d.]+', timing).group(1))
+    assert queries >= 2 and "app;dur=" in timing
+
+    login = client.post(
+        "/api/auth/login",
+        data=json.dumps({"username": "tester", "password": "password123"}),
+        content_type="application/json",
+    )
+    assert "kdf;dur=" in login.headers["Server-Timing"]
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="api.list_employees",method="GET",status="200"} 1' in body
+    assert f'http_request_db_queries_bucket{{endpoint="api.list_employees",le="{queries}"}} 1' in body
+    # One check for the auth_token fixture's login, one for ours.
+    assert 'password_hash_duration_seconds_count{operation="check"} 2' in body
+    assert f'db_query_duration_seconds_count{{endpoint="api.list_employees"}} {queries}' in body
+
+    app.config["DB_PROFILE"] = "production"
+    assert client.get("/metrics").status_code == 403
+    app.config["METRICS_TOKEN"] = "scrape-secret"
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
+
+
+def test_metrics_are_summed_across_worker_processes(tmp_path):
+    from app.metrics import MetricsRegistry
+
+    # Two registries sharing a directory stand in for two forked server workers.
+    first, second = MetricsRegistry(directory=str(tmp_path)), MetricsRegistry(directory=str(tmp_path))
+    first.request_queries.observe(2, "api.list_employees")
+    second.request_queries.observe(3, "api.list_employees")
+    second.request_queries.observe(4, "api.list_employees")
+    second.dump()
+
+    for registry in (first, second):
+        body = registry.render()
+        assert 'http_request_db_queries_count{endpoint="api.list_employees"} 3' in body
+        assert 'http_request_db_queries_sum{endpoint="api.list_employees"} 9' in body
+
+
+@pytest.mark.parametrize("backend", ["memory", "database"])
+def test_login_throttled_before_password_hashing(app, client, monkeypatch, backend):
+    from app import auth, throttle
+
+    app.config.update(LOGIN_THROTTLE_BACKEND=backend, LOGIN_RATE_LIMIT_USERNAME="3/60", LOGIN_RATE_LIMIT_IP="5/60")
+    throttle.init_app(app)
+    with app.app_context():
+        user = User(username="target", role="user")
+        user.set_password("right-password")
+        db.session.add(user)
+        db.session.commit()
+
+    hashed = []
+    real_check = auth.check_password_hash
+    monkeypatch.setattr(auth, "check_password_hash", lambda *args: hashed.append("dummy") or real_check(*args))
+    monkeypatch.setattr(User, "check_password", lambda self, password: hashed.append("user") or False)
+    monkeypatch.setattr(auth, "generate_password_hash", lambda *args: hashed.append("generate"))
+
+    def attempt(username):
+        return client.post(
+            "/api/auth/login",
+            data=json.dumps({"username": username, "password": "guess"}),
+            content_type="application/json",
+        )
+
+    assert [attempt("target").status_code for _ in range(3)] == [401, 401, 401]
+    throttled = attempt("target")
+    assert throttled.status_code == 429
+    assert int(throttled.headers["Retry-After"]) >= 1
+    assert hashed == ["user", "user", "user"]
+
+    # Unknown usernames pay for exactly one hash, so timing does not reveal which accounts exist.
+    assert attempt("nobody").status_code == 401
+    assert hashed == ["user", "user", "user", "dummy"]
+
+    # The per-IP bucket (5 attempts) is now empty as well.
+    response = client.post("/login", data={"username": "someone-else", "password": "guess"})
+    assert response.status_code == 429
+    assert "Too many login attempts" in response.get_data(as_text=True)
+    assert len(hashed) == 4
+
+
+def test_token_bucket_refills_over_time():
+    from app.throttle import MemoryBackend, parse_rate
+
+    capacity, refill = parse_rate("2/10")
+    backend = MemoryBackend()
+    assert [backend.consume("k", capacity, refill, now=100.0) for _ in range(2)] == [0.0, 0.0]
+    assert backend.consume("k", capacity, refill, now=100.0) == pytest.approx(5.0)
+    assert backend.consume("k", capacity, refill, now=106.0) == 0.0
+    with pytest.raises(ValueError):
+        parse_rate("ten per minute")
+
+
+def test_refresh_logout_and_in_memory_revocation(app, client):
+    from flask_jwt_extended import decode_token
+
+    client.post("/api/auth/register", json={"username": "tester", "password": "password123", "role": "admin"})
+    tokens = client.post("/api/auth/login", json={"username": "tester", "password": "password123"}).get_json()
+    access, refresh = tokens["access_token"], tokens["refresh_token"]
+    with app.app_context():
+        claims = decode_token(access)
+    assert claims["exp"] - claims["iat"] == app.config["JWT_ACCESS_TOKEN_EXPIRES"].total_seconds()
+
+    # Refresh tokens are only accepted by the refresh endpoint.
+    assert client.get("/api/employees/export", headers={"Authorization": f"Bearer {refresh}"}).status_code == 422
+    refreshed = client.post("/api/auth/refresh", headers={"Authorization": f"Bearer {refresh}"})
+    assert refreshed.status_code == 200
+    new_access = refreshed.get_json()["access_token"]
+    assert client.get("/api/employees/export", headers={"Authorization": f"Bearer {new_access}"}).status_code == 200
+
+    response = client.post("/api/auth/logout", json={"refresh_token": refresh}, headers={"Authorization": f"Bearer {access}"})
+    assert response.status_code == 200
+
+    # Revoked tokens are turned away from memory, before any SQL runs.
+    with assert_max_queries(app, 0):
+        response = client.get("/api/employees/export", headers={"Authorization": f"Bearer {access}"})
+    assert response.status_code == 401
+    assert client.post("/api/auth/refresh", headers={"Authorization": f"Bearer {refresh}"}).status_code == 401
+    # Other tokens stay valid.
+    assert client.get("/api/employees/export", headers={"Authorization": f"Bearer {new_access}"}).status_code == 200
+
+    # Another worker loads the same revocations from the database.
+    from app.tokens import RevocationList
+
+    with app.app_context():
+        other_worker = RevocationList(sync_interval=60)
+        other_worker.load()
+        assert other_worker.is_revoked(decode_token(access))
+        assert not other_worker.is_revoked(decode_token(new_access))
+
+
+def test_batch_api_atomic_and_best_effort(app, client, auth_token):
+    from app.models import AuditEvent
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+
+    response = client.post(
+        "/api/batch",
+        json={
+            "mode": "atomic",
+            "requests": [
+                {"method": "POST", "path": "/api/auth/register", "body": {"username": "ada", "password": "pw123456"}},
+                {"method": "POST", "path": "/api/employees", "body": {"user_id": 2, "name": "Ada Boateng", "role": "Barber", "salary": 3000, "start_date": "2024-05-01", "leave_days": 12}},
+                {"method": "PUT", "path": "/api/employees/1", "body": {"salary": 3500}},
+                {"method": "GET", "path": "/api/employees/1"},
+            ],
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["committed"] is True
+    assert [sub["status"] for sub in result["responses"]] == [201, 201, 200, 200]
+    assert result["responses"][3]["body"]["salary"] == 3500
+    with app.app_context():
+        assert Employee.query.one().salary == 3500
+    # Commit effects ran once the batch committed, so the search index and ETags saw the writes.
+    assert client.get("/api/employees/search?q=ada", headers=headers).get_json()["items"][0]["name"] == "Ada Boateng"
+    assert client.get("/api/employees/1", headers=headers).get_json()["salary"] == 3500
+
+    failing = [
+        {"method": "POST", "path": "/api/auth/register", "body": {"username": "grace", "password": "pw123456"}},
+        {"method": "PUT", "path": "/api/employees/1", "body": {"salary": 9999}},
+        {"method": "POST", "path": "/api/auth/register", "body": {"username": "ada", "password": "pw123456"}},
+        {"method": "DELETE", "path": "/api/employees/1"},
+    ]
+    with app.app_context():
+        app.extensions["audit_buffer"].flush()
+        audit_before = AuditEvent.query.count()
+
+    result = client.post("/api/batch", json={"mode": "atomic", "requests": failing}, headers=headers).get_json()
+    assert result["committed"] is False
+    assert [sub["status"] for sub in result["responses"]] == [201, 200, 400, 424]
+    with app.app_context():
+        assert User.query.filter_by(username="grace").count() == 0
+        assert Employee.query.one().salary == 3500
+        app.extensions["audit_buffer"].flush()
+        assert AuditEvent.query.count() == audit_before
+    assert client.get("/api/employees/1", headers=headers).get_json()["salary"] == 3500
+
+    result = client.post("/api/batch", json={"mode": "best_effort", "requests": failing[:3]}, headers=headers).get_json()
+    assert result["committed"] is True
+    assert [sub["status"] for sub in result["responses"]] == [201, 200, 400]
+    with app.app_context():
+        assert User.query.filter_by(username="grace").count() == 1
+        assert Employee.query.one().salary == 9999
+
+    assert client.post("/api/batch", json={"requests": [{"path": "/api/batch"}]}, headers=headers).status_code == 400
+    assert client.post("/api/batch", json={"mode": "sometimes", "requests": failing}, headers=headers).status_code == 400
+
+
+def test_batched_logins_use_the_callers_ip_bucket(app, client, auth_token):
+    from app import throttle
+
+    app.config.update(LOGIN_RATE_LIMIT_IP="2/60", LOGIN_RATE_LIMIT_USERNAME="100/60")
+    throttle.init_app(app)
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    login = {"method": "POST", "path": "/api/auth/login", "body": {"username": "tester", "password": "wrong"}}
+
+    def batch(remote_addr, count):
+        response = client.post(
+            "/api/batch",
+            json={"mode": "best_effort", "requests": [login] * count},
+            headers=headers,
+            environ_base={"REMOTE_ADDR": remote_addr},
+        )
+        return [item["status"] for item in response.get_json()["responses"]]
+
+    assert batch("10.0.0.1", 3) == [401, 401, 429]
+    # Another client's batched logins draw on its own bucket, not a shared one.
+    assert batch("10.9.9.9", 2) == [401, 401]
+    response = client.post("/api/auth/login", json=login["body"], environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert response.status_code == 429